@@ -0,0 +1,227 @@
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import zipfile
+from contextlib import contextmanager, ExitStack
+
+
+# Sidecar SQLite index of a zip archive: the members of the archive (including nested archives)
+# and the parsed fields of its metadata file, so repeated queries don't have to read the archive.
+# The members are only walked when they are first listed, not when the metadata is indexed.
+# The index is cleared when the archive's size changes, or its mtime and member CRCs change.
+INDEX_SUFFIX = '.index.sqlite'
+# Used when the index can't be written next to the archive
+FALLBACK_INDEX_DIR = os.getenv("MICROGPT_INDEX_DIR", ".archive_index")
+
+# Nested archives up to this size are read in memory, bigger ones are spooled to a temporary file
+NESTED_ZIP_SPOOL_THRESHOLD = int(os.getenv("MICROGPT_NESTED_ZIP_SPOOL_THRESHOLD", str(256 * 1024 * 1024)))
+
+# Seconds to wait for another process updating the same index
+INDEX_TIMEOUT = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS archive (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS members (
+    chain TEXT, name TEXT, size INTEGER, compressed_size INTEGER, header_offset INTEGER, crc INTEGER
+);
+CREATE TABLE IF NOT EXISTS metadata (item_id TEXT, field TEXT, value TEXT);
+CREATE INDEX IF NOT EXISTS metadata_field ON metadata (field);
+"""
+
+
+def _spool_member(zip_ref, name):
+    """ Copy a zip member into a spooled buffer, which only spills to disk above the threshold. """
+    buffer = tempfile.SpooledTemporaryFile(max_size=NESTED_ZIP_SPOOL_THRESHOLD)
+    with zip_ref.open(name) as source:
+        shutil.copyfileobj(source, buffer, 1024 * 1024)
+    buffer.seek(0)
+    return buffer
+
+
+@contextmanager
+def open_zip_chain(zip_path, chain):
+    """ Open the archive reached by following a chain of nested zip members from zip_path. """
+    with ExitStack() as stack:
+        zip_ref = stack.enter_context(zipfile.ZipFile(zip_path, 'r'))
+        for name in chain:
+            buffer = stack.enter_context(_spool_member(zip_ref, name))
+            zip_ref = stack.enter_context(zipfile.ZipFile(buffer, 'r'))
+        yield zip_ref
+
+
+def _walk_members(zip_ref, chain=()):
+    """ Yield (chain, ZipInfo) for every file in an open zip file and in the zip files nested in it. """
+    for info in zip_ref.infolist():
+        if info.is_dir():
+            continue
+        yield chain, info
+        if info.filename.endswith('.zip'):
+            # Search the nested zip file without extracting it
+            with _spool_member(zip_ref, info.filename) as buffer, zipfile.ZipFile(buffer, 'r') as nested_ref:
+                yield from _walk_members(nested_ref, chain + (info.filename,))
+
+
+def index_path(archive_path):
+    """ Path of the sidecar index of an archive. """
+    archive_path = os.path.abspath(archive_path)
+    if os.access(os.path.dirname(archive_path), os.W_OK):
+        return archive_path + INDEX_SUFFIX
+    os.makedirs(FALLBACK_INDEX_DIR, exist_ok=True)
+    name = hashlib.sha1(archive_path.encode()).hexdigest()
+    return os.path.join(FALLBACK_INDEX_DIR, name + INDEX_SUFFIX)
+
+
+def _crc_digest(zip_ref):
+    # Digest of the central directory: names, sizes and CRCs of the top-level members
+    digest = hashlib.sha1()
+    for info in zip_ref.infolist():
+        digest.update(f"{info.filename}\0{info.file_size}\0{info.CRC}\n".encode())
+    return digest.hexdigest()
+
+
+def _get(conn, key):
+    row = conn.execute("SELECT value FROM archive WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def _set(conn, key, value):
+    conn.execute("INSERT OR REPLACE INTO archive (key, value) VALUES (?, ?)", (key, str(value)))
+
+
+def _is_stale(conn, stat):
+    return _get(conn, 'size') != str(stat.st_size) or _get(conn, 'mtime_ns') != str(stat.st_mtime_ns)
+
+
+def _reset(conn, stat, crc_digest):
+    conn.execute("DELETE FROM archive")
+    conn.execute("DELETE FROM members")
+    conn.execute("DELETE FROM metadata")
+    _set(conn, 'mtime_ns', stat.st_mtime_ns)
+    _set(conn, 'size', stat.st_size)
+    _set(conn, 'crc_digest', crc_digest)
+
+
+def _index_members(conn, archive_path):
+    print(f"Indexing {archive_path}...")
+    conn.execute("DELETE FROM members")
+    with zipfile.ZipFile(archive_path, 'r') as zip_ref:
+        conn.executemany(
+            "INSERT INTO members VALUES (?, ?, ?, ?, ?, ?)",
+            ((json.dumps(chain), info.filename, info.file_size, info.compress_size, info.header_offset, info.CRC)
+             for chain, info in _walk_members(zip_ref)))
+    _set(conn, 'members_indexed', 1)
+
+
+@contextmanager
+def open_index(archive_path, members=False):
+    """
+    Opens the sidecar index of a zip archive, clearing it if the archive changed.
+
+    :param archive_path: Path to the zip archive.
+    :param members: Whether the members of the archive (and of its nested archives) are needed,
+                    in which case they are indexed if they weren't yet.
+    :return: Context manager yielding an sqlite3 connection.
+    """
+    stat = os.stat(archive_path)
+    # find_json, search_metadata_index and the extraction tools can update the same index concurrently
+    conn = sqlite3.connect(index_path(archive_path), timeout=INDEX_TIMEOUT)
+    try:
+        conn.executescript(SCHEMA)
+        if _is_stale(conn, stat) or (members and _get(conn, 'members_indexed') is None):
+            # One connection updates the index at a time, the next ones find it up to date
+            conn.execute("BEGIN IMMEDIATE")
+            if _is_stale(conn, stat):
+                with zipfile.ZipFile(archive_path, 'r') as zip_ref:
+                    crc_digest = _crc_digest(zip_ref)
+                if _get(conn, 'size') == str(stat.st_size) and _get(conn, 'crc_digest') == crc_digest:
+                    # Only touched: the members are unchanged
+                    _set(conn, 'mtime_ns', stat.st_mtime_ns)
+                else:
+                    _reset(conn, stat, crc_digest)
+            if members and _get(conn, 'members_indexed') is None:
+                _index_members(conn, archive_path)
+            conn.commit()
+        yield conn
+    finally:
+        conn.close()
+
+
+def index_members(archive_path):
+    """
+    Lists every file in a zip archive, including the files in nested zip archives.
+
+    :param archive_path: Path to the zip archive.
+    :return: List of (chain, member name) tuples, where chain is the tuple of nested zip members containing the file.
+    """
+    with open_index(archive_path, members=True) as conn:
+        return [(tuple(json.loads(chain)), name)
+                for chain, name in conn.execute("SELECT chain, name FROM members ORDER BY rowid")]
+
+
+def store_metadata(archive_path, member_name, items):
+    """
+    Stores the parsed metadata file of an archive in its index, one row per item and field.
+
+    :param archive_path: Path to the zip archive.
+    :param member_name: Name of the metadata member in the archive.
+    :param items: Iterable of (item_id, item_data) pairs.
+    :return: Number of indexed items.
+    """
+    count = 0
+    with open_index(archive_path) as conn:
+        conn.execute("DELETE FROM metadata")
+        for item_id, item_data in items:
+            conn.executemany("INSERT INTO metadata VALUES (?, ?, ?)",
+                             ((item_id, field, json.dumps(value, ensure_ascii=False))
+                              for field, value in item_data.items()))
+            count += 1
+        _set(conn, 'metadata_member', member_name)
+        conn.commit()
+    return count
+
+
+def metadata_fields(archive_path):
+    """
+    Returns the metadata fields stored in the index of an archive, in order of appearance,
+    or an empty list if the metadata was not indexed yet.
+    """
+    with open_index(archive_path) as conn:
+        if _get(conn, 'metadata_member') is None:
+            return []
+        return [field for field, in conn.execute(
+            "SELECT field FROM metadata GROUP BY field ORDER BY MIN(rowid)")]
+
+
+def _like_pattern(keyword):
+    # Matches the values containing the keyword, with its LIKE wildcards (% and _) taken literally
+    escaped = str(keyword).replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"%{escaped}%"
+
+
+def query_metadata(archive_path, fields, keywords=None):
+    """
+    Reads the selected metadata fields of an archive from its index.
+
+    :param archive_path: Path to the zip archive.
+    :param fields: List of the fields to return.
+    :param keywords: Optional list of keywords. Only the items whose selected fields contain all of them are returned.
+    :return: Dictionary of item_id: {field: value}.
+    """
+    fields = list(fields)
+    placeholders = ", ".join("?" * len(fields))
+    query = f"SELECT item_id, field, value FROM metadata WHERE field IN ({placeholders})"
+    params = list(fields)
+    for keyword in keywords or []:
+        query += (f" AND item_id IN (SELECT item_id FROM metadata WHERE field IN ({placeholders})"
+                  f" AND value LIKE ? ESCAPE '\\')")
+        params += fields + [_like_pattern(keyword)]
+    query += " ORDER BY rowid"
+
+    results = {}
+    with open_index(archive_path) as conn:
+        for item_id, field, value in conn.execute(query, params):
+            results.setdefault(item_id, {})[field] = json.loads(value)
+    return results
@@ -5,16 +5,41 @@ import os
 from PIL import Image
 import io
 import mimetypes
+import threading
+import types
+from collections import OrderedDict
 from utils import *
-import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from tool_registry import TOOLS, call_tool, register_tool, tool_metrics, tool_schemas
+from tool_output import compact_output, read_tool_artifact
+from event_log import log_event
+from tracing import traced
 
 
 # Configure your OpenAI API key
 openai.api_key = os.getenv("OPENAI_API_KEY") or "YOUR_API_KEY"
 client = openai.OpenAI(api_key=openai.api_key)
 
+# Assistants retrieved or created in this process, by assistant ID file: (assistant, tools JSON)
+_assistants = {}
+_assistants_lock = threading.Lock()
+
+
 # Create an Assistant with custom function definitions
 def create_assistant(assistant_name=None, model_name=None, tools=None, instructions=None, assistant_id_file="assistant_id_microgpt"):
+    tools_json = json.dumps(tools, sort_keys=True) if tools is not None else None
+    with _assistants_lock:
+        # Reuse the assistant of a previous call instead of retrieving it again
+        cached = _assistants.get(assistant_id_file)
+        if cached is not None and (tools is None or cached[1] == tools_json):
+            return cached[0]
+        assistant = _retrieve_or_create_assistant(assistant_name, model_name, tools, instructions, assistant_id_file)
+        _assistants[assistant_id_file] = (assistant, tools_json)
+        return assistant
+
+
+def _retrieve_or_create_assistant(assistant_name, model_name, tools, instructions, assistant_id_file):
     # Check if the assistant ID file exists
     if os.path.exists(assistant_id_file):
         # Read the assistant ID from the file
@@ -40,6 +65,13 @@ def create_assistant(assistant_name=None, model_name=None, tools=None, instructi
     assistant = client.beta.assistants.retrieve(assistant_id)
     print(f"Assistant retrieved with ID: {assistant.id}")
 
+    # Keep the tools of a stored assistant in sync with the tool definitions in the code
+    if tools is not None:
+        current_tools = [tool.model_dump(exclude_none=True) for tool in assistant.tools]
+        if json.dumps(current_tools, sort_keys=True) != json.dumps(tools, sort_keys=True):
+            assistant = client.beta.assistants.update(assistant_id, tools=tools)
+            print(f"Assistant tools updated for ID: {assistant.id}")
+
     return assistant
 
 
@@ -53,6 +85,20 @@ def create_thread():
 
 
 
+# Create a Thread with the user's message and run it, in a single request
+def create_thread_and_run(assistant, user_message):
+    print(f"Creating a Thread with the user's message and running the Assistant: '{user_message}'")
+    run = client.beta.threads.create_and_run(
+        assistant_id=assistant.id,
+        thread={"messages": [{"role": "user", "content": user_message}]}
+    )
+    # Only the ID of the thread is needed to follow up
+    thread = types.SimpleNamespace(id=run.thread_id)
+    print(f"Thread created with ID: {thread.id}")
+    return thread, run
+
+
+
 # Add a user's message to the Thread and create a Run
 def send_message_and_run_assistant(thread, assistant, user_message):
     print(f"Adding user's message to the Thread: '{user_message}'")
@@ -71,25 +117,90 @@ def send_message_and_run_assistant(thread, assistant, user_message):
 
 
 
+# Polling interval of poll_run_status in seconds: starts short and backs off exponentially
+POLL_INITIAL_INTERVAL = float(os.getenv("MICROGPT_POLL_INITIAL_INTERVAL", "0.1"))
+POLL_MAX_INTERVAL = float(os.getenv("MICROGPT_POLL_MAX_INTERVAL", "5"))
+POLL_BACKOFF = 1.5
+
+# Latency metrics of every run polled in this process
+run_metrics = []
+
 # Poll the Run status and handle function calls
+@traced(category="run")
 def poll_run_status(thread, run):
+    start = time.perf_counter()
+    time_to_first_action = None
+    tool_time = 0.0
+    polls = 0
+    interval = POLL_INITIAL_INTERVAL
+    waiting = False
     while True:
         run = client.beta.threads.runs.retrieve(
             thread_id=thread.id,
             run_id=run.id
         )
-        if run.status in ['completed', 'failed', 'cancelled']:
+        polls += 1
+        if run.status in ['completed', 'failed', 'cancelled', 'expired']:
             break
         elif run.status == 'requires_action':
+            if time_to_first_action is None:
+                time_to_first_action = time.perf_counter() - start
+            tool_start = time.perf_counter()
             handle_required_actions(thread, run)
+            tool_time += time.perf_counter() - tool_start
+            # The run resumes right after the outputs are submitted, so poll quickly again
+            interval = POLL_INITIAL_INTERVAL
+            waiting = False
         else:
-            print("Waiting for the Assistant to process...")
-            time.sleep(5)
+            if not waiting:
+                print("Waiting for the Assistant to process...")
+                waiting = True
+            time.sleep(interval)
+            interval = min(interval * POLL_BACKOFF, POLL_MAX_INTERVAL)
+
+    metrics = {
+        "run_id": run.id,
+        "status": run.status,
+        "wall_time": time.perf_counter() - start,
+        "time_to_first_action": time_to_first_action,
+        "tool_time": tool_time,
+        "polls": polls
+    }
+    run_metrics.append(metrics)
+    first_action = f"{time_to_first_action:.2f}s" if time_to_first_action is not None else "n/a"
+    print(f"Run {run.status} in {metrics['wall_time']:.2f}s "
+          f"(first action: {first_action}, tools: {tool_time:.2f}s, polls: {polls})")
+    # Per-tool latency accounting of this process
+    for name, tool_stats in tool_metrics().items():
+        print(f"  {name}: {tool_stats['calls']} calls, mean {tool_stats['mean_time']:.2f}s, "
+              f"max {tool_stats['max_time']:.2f}s, errors {tool_stats['errors']}, timeouts {tool_stats['timeouts']}")
     return run
 
+# Plans of the sub-assistants already asked for in this process, by model and normalized messages
+PLAN_CACHE_SIZE = int(os.getenv("MICROGPT_PLAN_CACHE_SIZE", "128"))
+_plan_cache = OrderedDict()
+_plan_cache_lock = threading.Lock()
+
+
+def _plan_key(messages, model, temperature, max_tokens):
+    # Case and whitespace don't change the intent of a message
+    normalized = [{"role": message["role"], "content": " ".join(message["content"].lower().split())}
+                  for message in messages]
+    return json.dumps([model, temperature, max_tokens, normalized])
+
+
 client = openai.Client()
+@traced(category="llm")
 def get_completion(messages, model="gpt-4-1106-preview", 
-                temperature=0, max_tokens=500):
+                temperature=0, max_tokens=500, use_cache=False):
+
+    if use_cache:
+        key = _plan_key(messages, model, temperature, max_tokens)
+        with _plan_cache_lock:
+            if key in _plan_cache:
+                _plan_cache.move_to_end(key)
+                print("Reusing the plan of a previous request")
+                return _plan_cache[key]
 
     completion = client.chat.completions.create(
         model= model,
@@ -97,7 +208,14 @@ def get_completion(messages, model="gpt-4-1106-preview",
         temperature=temperature,
         max_tokens=max_tokens
     )
-    return completion.choices[0].message.content
+    content = completion.choices[0].message.content
+
+    if use_cache:
+        with _plan_cache_lock:
+            _plan_cache[key] = content
+            while len(_plan_cache) > PLAN_CACHE_SIZE:
+                _plan_cache.popitem(last=False)
+    return content
 
 def execute_step(thread, assistant, step):
     run = send_message_and_run_assistant(thread, assistant, step)
@@ -105,7 +223,67 @@ def execute_step(thread, assistant, step):
     response = display_final_response(thread, run)
     return response
 
+# Start a new thread with the first step, creating the thread and the run in one request
+def execute_first_step(assistant, step):
+    thread, run = create_thread_and_run(assistant, step)
+    run = poll_run_status(thread, run)
+    response = display_final_response(thread, run)
+    return thread, response
+
+
+# Sub-assistants used by data_analysis, data_filter and tool_reuse
+SUB_ASSISTANTS = {
+    "data_analysis": {
+        "name": "Data gpt",
+        "model": 'gpt-4-1106-preview',
+        "instructions": "This assistant will help you to analyse 3D images in a specific directory.",
+        "tools": ("tau_factor", "batch_tau_factor", "extract_image_paths", "read_tool_artifact"),
+        "assistant_id_file": "assistant_id_datagpt.txt"
+    },
+    "data_filter": {
+        "name": "Filter gpt",
+        "model": 'gpt-4-1106-preview',
+        "instructions": "This assistant will help you to filter data based on specific criterial in a dataset. You don't need user to upload the dataset file to this platform\
+        you can use the given function directly with the dataset file directory.\
+            IMPORTANT: the directory always looks like './+filename.zip',  without ./mnt/data",
+        "tools": ("find_json", "search_metadata_index", "extract_files_from_folder_or_zip", "read_tool_artifact"),
+        "assistant_id_file": "assistant_id_filtergpt.txt"
+    },
+    "tool_reuse": {
+        "name": "Tool resuse gpt",
+        "model": 'gpt-4-1106-preview',
+        "instructions": "This is an assistant to reuse the tools. It can modify the code of a file according to user's needs and then run it\
+            IMPORTANT: the directory always looks like './+filename.zip',  without ./mnt/data",
+        "tools": ("read_file", "create_and_execute_python_file", "read_tool_artifact"),
+        "assistant_id_file": "assistant_id_toolgpt.txt"
+    }
+}
+
+
+def get_sub_assistant(name):
+    config = SUB_ASSISTANTS[name]
+    return create_assistant(config["name"], config["model"], tool_schemas(*config["tools"]),
+                            config["instructions"], assistant_id_file=config["assistant_id_file"])
+
+
+# Retrieve the sub-assistants in the background, so that the first sub-task doesn't wait for them
+def prewarm_assistants():
+    def prewarm():
+        for name in SUB_ASSISTANTS:
+            try:
+                get_sub_assistant(name)
+            except Exception as e:
+                print(f"Cannot prepare the assistant {name}: {e}")
+    threading.Thread(target=prewarm, daemon=True).start()
+
 # Define a function to analyze the images in a directory
+@register_tool(
+    description="This function processes a user query about analyzing 3D images in a specific directory. It uses a GPT-4 model to generate steps for analysis, which includes extracting image filenames, simulating analysis on the images, and storing the results in a CSV file. The function executes these steps and provides a final response based on the analysis.",
+    properties={
+        "user_message": {"type": "string", "description": "The user's query about analyzing 3D images, which will be processed by the GPT-4 model."}
+    },
+    response="Message"
+)
 def data_analysis(user_message):
     
     delimiter = "####"
@@ -118,9 +296,10 @@ def data_analysis(user_message):
           If the user is asking about analyzing 3D images in a specific directory,
               call a function to extract the filenames of images in the directory.
 
-    Step 2:{delimiter} Next, call a simulation function to analyze the images.
+    Step 2:{delimiter} Next, call the batch simulation function batch_tau_factor once with the directory to analyze all the images together.
 
-    Step 3:{delimiter}:Finally, store all the data in a CSV file.
+    Step 3:{delimiter}:Finally, store all the data in a CSV file with the output_csv option of batch_tau_factor. \
+          Every simulation is also appended to the results store ./results.sqlite, which read_file can query.
 
 
     Use the following format:
@@ -138,7 +317,7 @@ def data_analysis(user_message):
     'content': f"{delimiter}{user_message}{delimiter}"},  
     ] 
 
-    response = get_completion(messages)
+    response = get_completion(messages, use_cache=True)
 
     try:
         steps = response.split("Step ")
@@ -154,59 +333,23 @@ def data_analysis(user_message):
     except Exception as e:
         final_response = "Sorry, I'm having trouble right now, please try asking another question."
         
-    assistant_name_datagpt = "Data gpt"
-    model_name_datagpt = 'gpt-4-1106-preview'
-    instructions_datagpt = "This assistant will help you to analyse 3D images in a specific directory."
-    tools_datagpt = [
-        
-        {
-                "type": "function",
-                "function": {
-                "name": "tau_factor",
-                "description": "Calculate effective diffusivity, tortuosity factors, volume faction and surface area from tomographic data/3D voxel image. The function is only suitable for two-phase images",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                    "query_img": {"type": "string", "description": "the path of tomographic data/3D voxel image to analyse. \
-                                    it always look like './data/microstructure393.tif', without /mnt"},
-                    "D_eff_value": {"type": "number", "description": "the effective diffusivity value"},
-                    "tau_value": {"type": "number", "description": "the tortuosity factor value"},
-                    "volume_fraction_value": {"type": "number", "description": "the volume fraction value"},
-                    "surface_area_value": {"type": "number", "description": "the surface area value"},
-                    },
-                    "required": ["query_img"]
-                }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "extract_image_paths",
-                    "description": "This function extracts the filenames of image files within that directory, particularly those in TIFF format, and compiles these filenames into a list. The function then writes this list to a text file and also creates a descriptive sentence that includes all the extracted image paths. ",
-                    "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "directory": {
-                        "type": "string",
-                        "description": "The local directory to search for image files (e.g., './3DvoxelImage')."
-                        }
-                    },
-                    "required": ["directory"]
-                    }
-                }
-            }
-    ]
-    assistant = create_assistant(assistant_name_datagpt, model_name_datagpt, tools_datagpt, instructions_datagpt,assistant_id_file="assistant_id_datagpt.txt")
-    thread = create_thread()
+    assistant = get_sub_assistant("data_analysis")
 
     final_message = "have a conclusion of the previous steps and response to user in 3 sentences"
-    execute_step(thread, assistant, step1)
+    thread, _ = execute_first_step(assistant, step1)
     execute_step(thread, assistant, step2)
     execute_step(thread, assistant, step3)
     final_response = execute_step(thread, assistant, final_message)
 
     return final_response
 
+@register_tool(
+    description="This function guides the user through a process to filter data (apply certain criteria to find all pieces of data based on specific conditions or attributes) from a dataset based on specific criteria. It outlines steps for confirming the user's request to filter data, using a function to extract metadata from a dataset, and then filtering the data according to the user's criteria. The function utilizes a systematic approach involving user and system messages, and leverages other functions like 'find_json' and 'extract_files_from_folder_or_zip' for data handling.",
+    properties={
+        "user_message": {"type": "string", "description": "The user's message or query related to data filtering."}
+    },
+    response="Message"
+)
 def data_filter(user_message):
     
     delimiter = "####"
@@ -220,7 +363,7 @@ def data_filter(user_message):
         Determine the directory of the database directly from users' input.
     Step 2:{delimiter} If the user is asking about 
                 filter 3D images in a dataset, you have a function called find_json, you can use it to unfold zip file, find the meta data of the dataset in the file and extract the metadata. Don't use other functions to extract the metadata.
-    Step 3:{delimiter} Now that you have the metadata, which is in a JSON format, focus on the description and keywords within the metadata. Filter all the data in the database that aligns with the user's criteria.adata, and filter all the data in the database which align with the user's criteria.
+    Step 3:{delimiter} Now that you have the metadata, which is in a JSON format, focus on the description and keywords within the metadata. You can use search_metadata_index to look up the items matching keywords of the user's criteria. Filter all the data in the database that aligns with the user's criteria.adata, and filter all the data in the database which align with the user's criteria.
 
 
     Use the following format:
@@ -238,66 +381,11 @@ def data_filter(user_message):
     'content': f"{delimiter}{user_message}{delimiter}"},  
     ] 
 
-    response = get_completion(messages)
-        
-    assistant_name_filtergpt = "Filter gpt"
-    model_name_filtergpt = 'gpt-4-1106-preview'
-    instructions_filtergpt = "This assistant will help you to filter data based on specific criterial in a dataset. You don't need user to upload the dataset file to this platform\
-        you can use the given function directly with the dataset file directory.\
-            IMPORTANT: the directory always looks like './+filename.zip',  without ./mnt/data"
-    tools_datagpt = [
-        
-                {
-                    "type": "function",
-                    "function": {
-                        "name": "find_json",
-                        "description": "Unzips a zip file or searches a directory to find metadata files in JSON or XML format. Prompts the user for confirmation before extracting the metadata. Returns the contents of the metadata file or a message if no metadata is found.",
-                        "parameters": {
-                            "type": "object",
-                            "properties": {
-                                "file_or_dir_path": {
-                                    "type": "string",
-                                    "description": "The path to the zip file or directory where the metadata search is performed, it is always look like ./+filename, without mnt/data/."
-                                }
-                            },
-                            "required": ["file_or_dir_path"]
-                        }
-                    }
-                },
-                {
-                    "type": "function",
-                    "function": {
-                        "name": "extract_files_from_folder_or_zip",
-                        "description": "Extracts files with a specified name from a given folder or zip file, including any nested folders and zip files within. The function searches for files that match the target filename in the source path, which can be either a directory or a zip file. If found, the files are extracted to a specified destination folder.",
-                        "parameters": {
-                            "type": "object",
-                            "properties": {
-                                "source_path": {
-                                    "type": "string",
-                                    "description": "Path to the source folder or zip file."
-                                },
-                                "target_filename": {
-                                    "type": "string",
-                                    "description": "Name of the file to search for and extract."
-                                },
-                                "destination_folder": {
-                                    "type": "string",
-                                    "default": "DATA",
-                                    "description": "Folder where the extracted files will be stored. Default is 'DATA'."
-                                }
-                            },
-                            "required": ["source_path", "target_filename"]
-                        }
-                    }
-                }
-
-
-    ]
-
-    assistant = create_assistant(assistant_name_filtergpt, model_name_filtergpt, tools_datagpt, instructions_filtergpt,assistant_id_file="assistant_id_filtergpt.txt")
-    thread = create_thread()
-
-    response1 = execute_step(thread, assistant, "the directory always look like ./+filename.zip, but not mnt/data/+filename:\n"+response)
+    response = get_completion(messages, use_cache=True)
+
+    assistant = get_sub_assistant("data_filter")
+
+    thread, response1 = execute_first_step(assistant, "the directory always look like ./+filename.zip, but not mnt/data/+filename:\n"+response)
     user_input = input("Please input an exmaple of data filename:")
     user_message2 = f"The user input an exmaple of data filename {user_input}. Based on the filename example provided by the user, deduce the pattern of filenames of the extracted data.\
         and list all the filenames of extracted data. \
@@ -310,6 +398,13 @@ def data_filter(user_message):
 
     return response3
 
+@register_tool(
+    description="Provides a systematic approach to reuse the tool that created before. It outlines a series of steps to confirm if the user wants to modify and run existing tool code, read the file using read_file function, make necessary code modifications, and finally save and execute the modified code using create_and_execute_python_file function.",
+    properties={
+        "user_message": {"type": "string", "description": "The user's input message which indicates their requirements or queries regarding code modification and execution."}
+    },
+    response="Message"
+)
 def tool_reuse(user_message):
     
     delimiter = "####"
@@ -338,176 +433,107 @@ def tool_reuse(user_message):
     'content': f"{delimiter}{user_message}{delimiter}"},  
     ] 
 
-    response = get_completion(messages)
-        
-    assistant_name_toolgpt = "Tool resuse gpt"
-    model_name_toolgpt = 'gpt-4-1106-preview'
-    instructions_toolgpt = "This is an assistant to reuse the tools. It can modify the code of a file according to user's needs and then run it\
-            IMPORTANT: the directory always looks like './+filename.zip',  without ./mnt/data"
-    tools_toolgpt = [
-        
-                {
-                "type": "function",
-                "function": {
-                    "name": "read_file",
-                    "description": "Reads a file and returns its contents based on the file extension. It supports .csv and .py files. For .csv files, it returns a list of lists, each representing a row. For .py files, it returns the file content as a string.",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "file_path": {
-                                "type": "string",
-                                "description": "Path to the file to be read. The path look like './example.csv' or './script.py', without ./mnt/data."
-                            }
-                        },
-                        "required": ["file_path"]
-                    }
-                }
-            },
-               {
-                "type": "function",
-                "function": {
-                    "name": "create_and_execute_python_file",
-                    "description": "Creates a Python script file with the provided code and executes it upon the user's consent. The script is saved with a specified filename, and the user is prompted to allow its execution.",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "code": {
-                                "type": "string",
-                                "description": "String containing the code to be included in the script."
-                            },
-                            "output_filename": {
-                                "type": "string",
-                                "default": "created_script.py",
-                                "description": "Filename for the created Python script. Default is 'created_script.py'."
-                            }
-                        },
-                        "required": ["code"]
-                    }
-                }
-            }
-
-    ]
-
-    assistant = create_assistant(assistant_name_toolgpt, model_name_toolgpt, tools_toolgpt, instructions_toolgpt,assistant_id_file="assistant_id_toolgpt.txt")
-    thread = create_thread()
-
-    response = execute_step(thread, assistant, response + "in the code you are writing, please make sure the directory always look like ./+filename.zip, but not mnt/data/+filename:\n")
+    response = get_completion(messages, use_cache=True)
+
+    assistant = get_sub_assistant("tool_reuse")
+
+    thread, response = execute_first_step(assistant, response + "in the code you are writing, please make sure the directory always look like ./+filename.zip, but not mnt/data/+filename:\n")
 
     return response
 
+# Tool call execution settings: "thread" or "process" pool and number of workers.
+# Per-tool timeouts, concurrency limits and metrics are kept by the tool registry of this process
+TOOL_EXECUTOR = os.getenv("MICROGPT_TOOL_EXECUTOR", "thread")
+TOOL_WORKERS = int(os.getenv("MICROGPT_TOOL_WORKERS", str(os.cpu_count() or 1)))
+
+
+# Execute a single function call requested by the Assistant
+def execute_tool_call(func_name, arguments, process_pool=None):
+    if process_pool is None:
+        return call_tool(func_name, arguments)
+    # The function runs in a worker process, its concurrency limit and metrics are applied here
+    return call_tool(func_name, arguments, run=lambda func, kwargs: process_pool.submit(func, **kwargs).result())
+
+
+def _call_result(future, func_name, deadline):
+    """ Waits for a function call until its deadline, returning errors as responses. """
+    timeout = None if deadline is None else max(0, deadline - time.monotonic())
+    try:
+        return future.result(timeout=timeout)
+    except FuturesTimeoutError:
+        future.cancel()
+        TOOLS[func_name].record_timeout()
+        return {"Error": f"Function '{func_name}' timed out after {TOOLS[func_name].timeout} seconds"}
+    except Exception as e:
+        return {"Error": f"Function '{func_name}' failed: {e}"}
+
+
+def _run_tool_calls(calls, max_workers=1, process_pool=None):
+    """
+    Runs independent function calls concurrently, with error handling. The timeout of each call
+    counts from its submission, so waiting for one call doesn't extend the timeout of the others.
+    A call that times out is abandoned, its thread (or worker process) finishes it in the background.
+    """
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    futures = {}
+    deadlines = {}
+    for call_id, func_name, arguments in calls:
+        futures[call_id] = executor.submit(execute_tool_call, func_name, arguments, process_pool)
+        timeout = TOOLS[func_name].timeout
+        deadlines[call_id] = time.monotonic() + timeout if timeout else None
+    responses = {call_id: _call_result(futures[call_id], func_name, deadlines[call_id])
+                 for call_id, func_name, _ in calls}
+    # Don't block on calls that timed out
+    executor.shutdown(wait=False, cancel_futures=True)
+    return responses
+
+
+def _run_tool_call_inline(func_name, arguments):
+    """ Runs a function call on the main thread, without timeout, returning errors as responses. """
+    try:
+        return execute_tool_call(func_name, arguments)
+    except Exception as e:
+        return {"Error": f"Function '{func_name}' failed: {e}"}
+
+
 # Handle the required actions for function calls
+@traced(category="tool")
 def handle_required_actions(thread, run):
     print("Assistant requires function calls...")
     required_actions = run.required_action.submit_tool_outputs
-    with open("required_actions.json", "w") as f:
-                required_actions_json = required_actions.model_dump()
-                json.dump(required_actions_json, f, indent=4)
-    tool_outputs = []
-
-    for action in required_actions.tool_calls:
-        func_name = action.function.name
-        arguments = json.loads(action.function.arguments)
-        if func_name == "tau_factor":
-            query_img_path = arguments.get("query_img")
-            results = tau_factor(query_img_path)
-
-            # Prepare the function response in the expected format
-            function_response = {
-                "These are the JSON-formatted simulation results of the 3D images": results
-            }
-
-        elif func_name == "create_and_execute_python_file":
-            code = arguments.get("code")
-            output_filename = arguments.get("output_filename", "created_script.py")
-            results = create_and_execute_python_file(code, output_filename)
-            function_response = {
-                "Message": results                                
-                }
-            
-        elif func_name == "search_zenodo_datasets":
-            query = arguments.get("query")
-            max_results = arguments.get("max_results", 10)
-            results = search_zenodo_datasets(query, max_results)
-            function_response = {
-                "Results": results
-            }
-        elif func_name == "download_links_and_download_files":
-            page_url = arguments.get("page_url")
-            results = download_links_and_download_files(page_url)
-            function_response = {
-                "Message": results
-            }
-        elif func_name == "extract_and_organize_files":
-            zip_file_path = arguments.get("zip_file_path")
-            output_folder = arguments.get("output_folder")
-            file_extension = arguments.get("file_extension")
-            extract_and_organize_files(zip_file_path, output_folder, file_extension)
-            function_response = {
-                "Message": "Files extracted and organized successfully."
-            }
-        elif func_name == "read_file":
-            file_path = arguments.get("file_path")
-            results = read_file(file_path)
-            function_response = {
-                "Results": results
-            }
-        elif func_name == "upload_google_drive":
-            file_path = arguments.get("upload_filename")
-            resutls = upload_google_drive(file_path)
-            function_response = {
-                "Message": resutls
-            }
-        elif func_name == "extract_image_paths":
-            directory = arguments.get("directory")
-            output_file_path, image_path = extract_image_paths(directory)
-            function_response = {
-                "Image_path": image_path
-            }
-        elif func_name == "data_analysis":
-            user_message = arguments.get("user_message")
-            results = data_analysis(user_message)
-            function_response = {
-                "Message": results
-            }
-        
-        elif func_name == "find_json":
-            file_or_dir_path = arguments.get("file_or_dir_path")
-            results = find_json(file_or_dir_path)
-            function_response = {
-                "Message": results
-            }
-
-        elif func_name == "extract_files_from_folder_or_zip":
-            source_path = arguments.get("source_path")
-            target_filename = arguments.get("target_filename")
-            extract_files_from_folder_or_zip(source_path, target_filename)
-            function_response = {
-                "Message": "Files extracted successfully."
-            }
-        
-        elif func_name == "data_filter":
-            user_message = arguments.get("user_message")
-            results = data_filter(user_message)
-            function_response = {
-                "Message": results
-            }
-
-        elif func_name == "tool_reuse":
-            user_message = arguments.get("user_message")
-            results = tool_reuse(user_message)
-            function_response = {
-                "Message": results
-            }
-
+    log_event("required_actions", thread_id=thread.id, run_id=run.id, data=required_actions.model_dump())
+
+    calls = [(action.id, action.function.name, json.loads(action.function.arguments))
+             for action in required_actions.tool_calls]
+    responses = {}
+
+    # Independent calls run concurrently with their timeouts. Interactive ones (which prompt the user)
+    # and the other calls run afterwards on the main thread, in their original order and without timeout.
+    # Errors of every call are returned to the Assistant
+    parallel_calls = [call for call in calls if call[1] in TOOLS and TOOLS[call[1]].parallel]
+    if parallel_calls:
+        max_workers = max(1, min(TOOL_WORKERS, len(parallel_calls)))
+        if len(parallel_calls) > 1:
+            print(f"Running {len(parallel_calls)} function calls in parallel...")
+        if TOOL_EXECUTOR == "process" and len(parallel_calls) > 1:
+            process_pool = ProcessPoolExecutor(max_workers=max_workers)
+            try:
+                responses.update(_run_tool_calls(parallel_calls, max_workers, process_pool))
+            finally:
+                # Don't wait for worker processes of calls that timed out
+                process_pool.shutdown(wait=False, cancel_futures=True)
         else:
-            raise ValueError(f"Unknown function: {func_name}")
+            responses.update(_run_tool_calls(parallel_calls, max_workers))
 
-        print(f"Function '{func_name}' called with arguments: {arguments}")
+    for call_id, func_name, arguments in calls:
+        if call_id not in responses:
+            responses[call_id] = _run_tool_call_inline(func_name, arguments)
 
-        tool_outputs.append({
-            "tool_call_id": action.id,
-            "output": json.dumps(function_response)
-        })
+    # Outputs are submitted in the order of the tool calls, large ones compacted to the byte budget
+    # (pages of artifacts are not spilled again)
+    tool_outputs = [{"tool_call_id": call_id,
+                     "output": compact_output(func_name, responses[call_id], spill=func_name != "read_tool_artifact")}
+                    for call_id, func_name, _ in calls]
 
     print("Submitting function call outputs back to the Assistant...")
     client.beta.threads.runs.submit_tool_outputs(
@@ -518,23 +544,119 @@ def handle_required_actions(thread, run):
 
 
 
+# Files generated by the Assistants are downloaded once per process, concurrently, and keep the
+# name they were first saved under: file ID -> local path (None if the file type is not saved)
+FILE_DOWNLOAD_WORKERS = int(os.getenv("MICROGPT_FILE_DOWNLOAD_WORKERS", "8"))
+_downloaded_files = {}
+_file_names = {}
+_file_counters = {"image": 0, "data": 0}
+_files_lock = threading.Lock()
+
+
+def _file_name(file_id):
+    # File metadata never changes: retrieve it once
+    if file_id not in _file_names:
+        _file_names[file_id] = client.files.retrieve(file_id).filename
+    return _file_names[file_id]
+
+
+@traced(category="io")
+def _fetch_file(file_id, is_image):
+    filename = None if is_image else _file_name(file_id)
+    return filename, client.files.content(file_id).content
+
+
+def _save_file(file_id, filename, file_content, is_image):
+    """ Saves a downloaded file as image_N.png or data_N.csv, N being assigned once per file ID. """
+    file_type, _ = mimetypes.guess_type(filename) if filename else (None, None)
+    if is_image or file_type and file_type.startswith('image/'):
+        kind = "image"
+    elif file_type and file_type.startswith('text/csv') or filename.endswith('.csv'):
+        kind = "data"
+    else:
+        print(f"Unsupported file type: {file_type}")
+        return None
+    with _files_lock:
+        path = f"{kind}_{_file_counters[kind]}.{'png' if kind == 'image' else 'csv'}"
+        _file_counters[kind] += 1
+    if kind == "image":
+        Image.open(io.BytesIO(file_content)).save(path)
+    else:
+        with open(path, 'wb') as file:
+            file.write(file_content)
+    return path
+
+
+@traced(category="io")
+def download_files(file_ids):
+    """
+    Downloads the files generated by the Assistant that were not downloaded yet, all at once.
+
+    :param file_ids: Dictionary of file ID: whether the file is an image content of a message, in message order.
+    :return: List of the IDs of the newly downloaded files.
+    """
+    with _files_lock:
+        new_files = [(file_id, is_image) for file_id, is_image in file_ids.items() if file_id not in _downloaded_files]
+    if not new_files:
+        return []
+    with ThreadPoolExecutor(max_workers=min(FILE_DOWNLOAD_WORKERS, len(new_files))) as executor:
+        fetched = list(executor.map(lambda new_file: _fetch_file(*new_file), new_files))
+    # Names are assigned in message order, so the same conversation always gives the same names
+    for (file_id, is_image), (filename, file_content) in zip(new_files, fetched):
+        _downloaded_files[file_id] = _save_file(file_id, filename, file_content, is_image)
+    return [file_id for file_id, _ in new_files]
+
+
+MESSAGE_PAGE_SIZE = 100
+
+# Last message fetched from each thread: later fetches only list the messages after it
+_thread_cursors = {}
+
+
+def log_transcript(event, records, **fields):
+    """ Logs API objects (messages, run steps) to the session event log, one event per object. """
+    for record in records:
+        log_event(event, data=record.model_dump(), **fields)
+
+
+@traced(category="api")
+def fetch_new_messages(thread_id):
+    """
+    Lists the messages of a thread added since the previous call, oldest first.
+
+    :param thread_id: ID of the thread.
+    :return: List of the new messages.
+    """
+    new_messages = []
+    while True:
+        after = _thread_cursors.get(thread_id)
+        page = client.beta.threads.messages.list(
+            thread_id=thread_id,
+            order="asc",
+            limit=MESSAGE_PAGE_SIZE,
+            **({"after": after} if after else {})
+        )
+        new_messages.extend(page.data)
+        if page.data:
+            _thread_cursors[thread_id] = page.data[-1].id
+        if len(page.data) < MESSAGE_PAGE_SIZE:
+            return new_messages
+
+
+@traced(category="api")
 def display_final_response(thread, run):
-    messages = client.beta.threads.messages.list(
-    thread_id=thread.id
-    )
+    messages = fetch_new_messages(thread.id)
     run_steps = client.beta.threads.runs.steps.list(
         thread_id=thread.id,
         run_id=run.id
     )
-    # save the run steps to a json file
-    with open("run_steps.json", "w") as f:
-        run_steps_json = run_steps.model_dump()
-        json.dump(run_steps_json, f, indent=4)
-    # save the messages to a json file
-    with open("messages.json", "w") as f:
-        messages_json = messages.model_dump()
-        json.dump(messages_json, f, indent=4)
-    msg = messages.data[0]
+    # log the run steps and the new messages (before citations are added to their text)
+    log_transcript("run_step", run_steps.data, thread_id=thread.id, run_id=run.id)
+    log_transcript("message", messages, thread_id=thread.id)
+    if not messages:
+        print(f"No new messages (run {run.status})")
+        return ""
+    msg = messages[-1]
 
     for content in msg.content:
         # skip if content has "image_file" as attribute
@@ -545,15 +667,21 @@ def display_final_response(thread, run):
             print('Response================================')
             print("\033[93m"+f"{msg.role.capitalize()}: {content.text.value}"+"\033[0m")
             print('=====================================END')
-    
-
-    # Initialize a list to store updated messages
-    updated_messages = []
 
-    image_counter = 0
-    data_counter = 0
-    # Process each message in the messages list
-    for message in messages.data:
+    # Files of the new messages that were not downloaded yet
+    file_ids = {}
+    for message in messages:
+        for content_part in message.content:
+            if content_part.type == 'text':
+                for annotation in content_part.text.annotations:
+                    if (file_path := getattr(annotation, 'file_path', None)):
+                        file_ids.setdefault(file_path.file_id, False)
+            elif content_part.type == 'image_file':
+                file_ids.setdefault(content_part.image_file.file_id, True)
+    new_file_ids = download_files(file_ids)
+
+    # Process each new message
+    for message in messages:
         if message.content:
             citations = []
             for content_part in message.content:
@@ -563,43 +691,20 @@ def display_final_response(thread, run):
                     for index, annotation in enumerate(annotations):
                         text_value = text_value.replace(annotation.text, f' [{index}]')
                         if (file_citation := getattr(annotation, 'file_citation', None)):
-                            cited_file = client.files.retrieve(file_citation.file_id)
-                            citations.append(f'[{index}] {file_citation.quote} from {cited_file.filename}')
+                            citations.append(f'[{index}] {file_citation.quote} from {_file_name(file_citation.file_id)}')
                         elif (file_path := getattr(annotation, 'file_path', None)):
-                            cited_file = client.files.retrieve(file_path.file_id)
-                            citations.append(f'[{index}] Click <here> to download {cited_file.filename}')
-                            image_file_id = cited_file.id
-                            file_content: bytes = client.files.with_raw_response.retrieve_content(image_file_id).content
-                            file_type, _ = mimetypes.guess_type(cited_file.filename)
-                            if file_type and file_type.startswith('image/'):
-                                # if file is an image, open it with PIL
-                                image = Image.open(io.BytesIO(file_content))
-                                image.save(f"image_{image_counter}.png")
-                                image_counter += 1
-                            elif file_type and file_type.startswith('text/csv') or cited_file.filename.endswith('.csv'):
-                                # if file is a CSV file, read it into a Pandas DataFrame  
-                                csv_file = io.StringIO(file_content.decode())
-                                df = pd.read_csv(csv_file)
-                                df.to_csv(f"data_{data_counter}.csv", index=False)
-                                data_counter += 1
-                            else:
-                                print(f"Unsupported file type: {file_type}")
-                            
+                            saved = _downloaded_files.get(file_path.file_id)
+                            citations.append(f'[{index}] Click <here> to download {_file_name(file_path.file_id)}'
+                                             + (f' (saved to {saved})' if saved else ''))
+
                     text_value += '\n' + '\n'.join(citations)
                     content_part.text.value = text_value
 
-                    # might need to fix, if the file is not an image
-                elif content_part.type == 'image_file':
-                    image_file_id = content_part.image_file.file_id
-                    image_data: bytes = client.files.with_raw_response.retrieve_content(image_file_id).content
-                    image = Image.open(io.BytesIO(image_data))
-                    image.show()
-                    # save the image to a file
-                    image.save(f"image_{image_counter}.png")
-                    image_counter += 1
-            updated_messages.append(message)
-    # for updated_message in updated_messages:
-    #     print(updated_message.content[0].text.value)
-            
+                elif content_part.type == 'image_file' and content_part.image_file.file_id in new_file_ids:
+                    # Show the new images only
+                    saved = _downloaded_files.get(content_part.image_file.file_id)
+                    if saved:
+                        Image.open(saved).show()
+
     return content.text.value
 
@@ -0,0 +1,278 @@
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from openai import AsyncOpenAI
+
+from assistant_client_functions import (MESSAGE_PAGE_SIZE, POLL_BACKOFF, POLL_INITIAL_INTERVAL, POLL_MAX_INTERVAL,
+                                        TOOL_WORKERS, TOOLS, call_tool, compact_output, log_event, log_transcript,
+                                        run_metrics)
+from tracing import span
+
+
+# asyncio driver of the Assistants: run polling, tool calls and file downloads of several
+# conversations overlap in one process. The API base URL can be pointed to a local stub with
+# the OPENAI_BASE_URL environment variable.
+
+# Tool calls of all the conversations share one pool. Per-tool concurrency limits and timeouts
+# are applied by the tool registry
+_tool_executor = ThreadPoolExecutor(max_workers=TOOL_WORKERS)
+
+# Last message fetched from each thread: later fetches only list the messages after it
+_thread_cursors = {}
+
+
+def get_async_client():
+    """ Returns an async OpenAI client (OPENAI_API_KEY and OPENAI_BASE_URL are read from the environment). """
+    return AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY") or "YOUR_API_KEY")
+
+
+async def _run_tool_call(func_name, arguments):
+    """ Run one function call on the tool pool, returning an error response instead of raising. """
+    tool = TOOLS.get(func_name)
+    if tool is None:
+        return {"Error": f"Unknown function: {func_name}"}
+    loop = asyncio.get_running_loop()
+    try:
+        return await asyncio.wait_for(loop.run_in_executor(_tool_executor, call_tool, func_name, arguments),
+                                      timeout=tool.timeout)
+    except asyncio.TimeoutError:
+        tool.record_timeout()
+        return {"Error": f"Function '{func_name}' timed out after {tool.timeout} seconds"}
+    except Exception as e:
+        return {"Error": f"Function '{func_name}' failed: {e}"}
+
+
+async def handle_required_actions(client, thread_id, run):
+    """
+    Runs the function calls required by a run and submits their outputs.
+    Independent calls run concurrently, interactive ones afterwards in their original order.
+    """
+    print(f"[{thread_id}] Assistant requires function calls...")
+    log_event("required_actions", thread_id=thread_id, run_id=run.id,
+              data=run.required_action.submit_tool_outputs.model_dump())
+    calls = [(action.id, action.function.name, json.loads(action.function.arguments))
+             for action in run.required_action.submit_tool_outputs.tool_calls]
+
+    parallel_calls = [call for call in calls if call[1] in TOOLS and TOOLS[call[1]].parallel]
+    with span("handle_required_actions", "tool", track=f"thread {thread_id}", calls=len(calls)):
+        parallel_responses = await asyncio.gather(*(_run_tool_call(func_name, arguments)
+                                                    for _, func_name, arguments in parallel_calls))
+        responses = {call[0]: response for call, response in zip(parallel_calls, parallel_responses)}
+        for call_id, func_name, arguments in calls:
+            if call_id not in responses:
+                responses[call_id] = await _run_tool_call(func_name, arguments)
+
+    tool_outputs = [{"tool_call_id": call_id,
+                     "output": compact_output(func_name, responses[call_id], spill=func_name != "read_tool_artifact")}
+                    for call_id, func_name, _ in calls]
+    print(f"[{thread_id}] Submitting function call outputs back to the Assistant...")
+    return await client.beta.threads.runs.submit_tool_outputs(thread_id=thread_id, run_id=run.id,
+                                                               tool_outputs=tool_outputs)
+
+
+async def poll_run_status(client, thread_id, run):
+    """
+    Polls a run until it ends, handling its function calls. Other conversations run while it waits.
+
+    :return: The finished run.
+    """
+    start = time.perf_counter()
+    time_to_first_action = None
+    tool_time = 0.0
+    polls = 0
+    interval = POLL_INITIAL_INTERVAL
+    with span("poll_run_status", "run", track=f"thread {thread_id}", run_id=run.id) as attributes:
+        while True:
+            run = await client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run.id)
+            polls += 1
+            if run.status in ['completed', 'failed', 'cancelled', 'expired']:
+                break
+            elif run.status == 'requires_action':
+                if time_to_first_action is None:
+                    time_to_first_action = time.perf_counter() - start
+                tool_start = time.perf_counter()
+                await handle_required_actions(client, thread_id, run)
+                tool_time += time.perf_counter() - tool_start
+                interval = POLL_INITIAL_INTERVAL
+            else:
+                await asyncio.sleep(interval)
+                interval = min(interval * POLL_BACKOFF, POLL_MAX_INTERVAL)
+        attributes["status"] = run.status
+
+    metrics = {
+        "run_id": run.id,
+        "status": run.status,
+        "wall_time": time.perf_counter() - start,
+        "time_to_first_action": time_to_first_action,
+        "tool_time": tool_time,
+        "polls": polls
+    }
+    run_metrics.append(metrics)
+    print(f"[{thread_id}] Run {run.status} in {metrics['wall_time']:.2f}s "
+          f"(tools: {tool_time:.2f}s, polls: {polls})")
+    return run
+
+
+def _write_file(path, content):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'wb') as file:
+        file.write(content)
+
+
+async def download_file(client, file_id, output_dir='.', default_extension=''):
+    """
+    Downloads a file generated by the Assistant, fetching its metadata and content concurrently.
+    The local name starts with the file ID, so files with the same name (e.g. several result.csv)
+    never overwrite each other.
+
+    :return: Tuple (original filename, local path).
+    """
+    with span("download_file", "io", track=f"file {file_id}", file_id=file_id):
+        cited_file, content = await asyncio.gather(client.files.retrieve(file_id), client.files.content(file_id))
+    name = os.path.basename(cited_file.filename or '')
+    name = f"{file_id}_{name}" if os.path.splitext(name)[1] else f"{file_id}{default_extension}"
+    path = os.path.join(output_dir, name)
+    await asyncio.to_thread(_write_file, path, content.content)
+    return cited_file.filename, path
+
+
+async def fetch_new_messages(client, thread_id):
+    """ Lists the messages of a thread added since the previous call, oldest first. """
+    new_messages = []
+    while True:
+        after = _thread_cursors.get(thread_id)
+        page = await client.beta.threads.messages.list(thread_id=thread_id, order="asc", limit=MESSAGE_PAGE_SIZE,
+                                                       **({"after": after} if after else {}))
+        new_messages.extend(page.data)
+        if page.data:
+            _thread_cursors[thread_id] = page.data[-1].id
+        if len(page.data) < MESSAGE_PAGE_SIZE:
+            return new_messages
+
+
+async def display_final_response(client, thread_id, run, output_dir='.'):
+    """
+    Prints the response of a run and downloads the files it generated, all downloads at once.
+    Only the messages added since the previous run are fetched, and logged to the event log.
+
+    :return: Text of the latest message.
+    """
+    with span("fetch_new_messages", "api", track=f"thread {thread_id}"):
+        messages, run_steps = await asyncio.gather(fetch_new_messages(client, thread_id),
+                                                   client.beta.threads.runs.steps.list(thread_id=thread_id,
+                                                                                       run_id=run.id))
+    log_transcript("run_step", run_steps.data, thread_id=thread_id, run_id=run.id)
+    log_transcript("message", messages, thread_id=thread_id)
+
+    downloads = {}
+    for message in messages:
+        for content_part in message.content:
+            if content_part.type == 'text':
+                for annotation in content_part.text.annotations:
+                    if (file_path := getattr(annotation, 'file_path', None)):
+                        downloads[file_path.file_id] = ''
+            elif content_part.type == 'image_file':
+                downloads[content_part.image_file.file_id] = '.png'
+    file_ids = list(downloads)
+    saved = await asyncio.gather(*(download_file(client, file_id, output_dir, downloads[file_id])
+                                   for file_id in file_ids))
+    saved = dict(zip(file_ids, saved))
+
+    response = ""
+    if messages:
+        msg = messages[-1]
+        for content_part in msg.content:
+            if content_part.type != 'text':
+                continue
+            text_value = content_part.text.value
+            citations = []
+            for index, annotation in enumerate(content_part.text.annotations):
+                text_value = text_value.replace(annotation.text, f' [{index}]')
+                if (file_citation := getattr(annotation, 'file_citation', None)):
+                    citations.append(f'[{index}] {file_citation.quote}')
+                elif (file_path := getattr(annotation, 'file_path', None)) and file_path.file_id in saved:
+                    citations.append(f'[{index}] Saved {saved[file_path.file_id][0]} to {saved[file_path.file_id][1]}')
+            response = text_value + ('\n' + '\n'.join(citations) if citations else '')
+            print(f'[{thread_id}] Response================================')
+            print("\033[93m" + f"{msg.role.capitalize()}: {response}" + "\033[0m")
+            print(f'[{thread_id}] =====================================END')
+    return response
+
+
+async def send_message_and_run_assistant(client, assistant_id, thread_id, user_message):
+    """
+    Adds a user message to a thread and runs the Assistant. Without a thread, the thread, the
+    message and the run are created in a single request.
+
+    :return: Tuple (thread ID, run).
+    """
+    if thread_id is None:
+        run = await client.beta.threads.create_and_run(
+            assistant_id=assistant_id,
+            thread={"messages": [{"role": "user", "content": user_message}]}
+        )
+        return run.thread_id, run
+    await client.beta.threads.messages.create(thread_id=thread_id, role="user", content=user_message)
+    run = await client.beta.threads.runs.create(thread_id=thread_id, assistant_id=assistant_id)
+    return thread_id, run
+
+
+async def run_conversation(client, assistant_id, user_messages, output_dir='.'):
+    """
+    Runs a conversation: each user message is answered before the next one is sent.
+
+    :param client: Async OpenAI client.
+    :param assistant_id: ID of the Assistant.
+    :param user_messages: List of user messages.
+    :param output_dir: Folder for the files generated by the Assistant.
+    :return: List of the responses.
+    """
+    responses = []
+    thread_id = None
+    for user_message in user_messages:
+        thread_id, run = await send_message_and_run_assistant(client, assistant_id, thread_id, user_message)
+        run = await poll_run_status(client, thread_id, run)
+        responses.append(await display_final_response(client, thread_id, run, output_dir))
+    return responses
+
+
+async def serve_conversations(assistant_id, conversations, output_dir='.'):
+    """
+    Runs several conversations concurrently with one client.
+
+    :param assistant_id: ID of the Assistant.
+    :param conversations: List of conversations, each a list of user messages.
+    :param output_dir: Folder for the generated files, with one subfolder per conversation.
+    :return: List of the responses of each conversation.
+    """
+    client = get_async_client()
+    return await asyncio.gather(*(
+        run_conversation(client, assistant_id, user_messages, os.path.join(output_dir, f"conversation_{index}"))
+        for index, user_messages in enumerate(conversations)))
+
+
+async def main(assistant_id_file="assistant_id_microgpt.txt"):
+    # Interactive conversation with the Micro gpt assistant created by run_assistant.py
+    if not os.path.exists(assistant_id_file):
+        print(f"{assistant_id_file} not found, run run_assistant.py once to create the assistant")
+        return
+    with open(assistant_id_file, "r") as file:
+        assistant_id = file.read().strip()
+
+    client = get_async_client()
+    thread_id = None
+    while True:
+        user_message = await asyncio.to_thread(input, "Enter your message: ")
+        if user_message.lower() == "quit":
+            break
+        thread_id, run = await send_message_and_run_assistant(client, assistant_id, thread_id, user_message)
+        run = await poll_run_status(client, thread_id, run)
+        await display_final_response(client, thread_id, run)
+    print(f"Thanks and happy to serve you")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
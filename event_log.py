@@ -0,0 +1,121 @@
+import atexit
+import gzip
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+
+
+# Structured log of the assistant sessions: one JSON event per line (required actions, messages,
+# run steps...), one file per session. Events are queued and written by a background thread, off
+# the request path. The file is rotated when it grows over EVENT_LOG_MAX_BYTES, the rotated parts
+# are gzipped when EVENT_LOG_COMPRESS is set.
+EVENT_LOG_DIR = os.getenv("MICROGPT_EVENT_LOG_DIR", ".event_logs")
+EVENT_LOG_MAX_BYTES = int(os.getenv("MICROGPT_EVENT_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+EVENT_LOG_COMPRESS = os.getenv("MICROGPT_EVENT_LOG_COMPRESS", "0").lower() in ("1", "true", "yes")
+# The writer flushes at least this often (in seconds) while events arrive
+EVENT_LOG_FLUSH_INTERVAL = float(os.getenv("MICROGPT_EVENT_LOG_FLUSH_INTERVAL", "1"))
+
+
+class EventLog:
+    """
+    A per-session JSON lines event log written by a background thread.
+    """
+
+    def __init__(self, log_dir=EVENT_LOG_DIR, session=None, max_bytes=EVENT_LOG_MAX_BYTES,
+                 compress=EVENT_LOG_COMPRESS):
+        self.log_dir = log_dir
+        self.session = session or f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+        self.path = os.path.join(log_dir, f"{self.session}.jsonl")
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.rotations = 0
+        self._queue = queue.Queue()
+        self._file = None
+        self._writer = threading.Thread(target=self._run, name="event-log-writer", daemon=True)
+        self._writer.start()
+
+    def log(self, event, **fields):
+        """
+        Queues an event. Fields must be JSON-serializable (dump API objects with model_dump first).
+
+        :param event: Type of the event, e.g. 'required_actions'.
+        """
+        self._queue.put(dict({"time": time.time(), "session": self.session, "event": event}, **fields))
+
+    def flush(self):
+        """ Waits until the queued events are written. """
+        self._queue.join()
+
+    def close(self):
+        """ Writes the queued events and stops the writer. """
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+
+    def _run(self):
+        last_flush = time.monotonic()
+        while True:
+            try:
+                record = self._queue.get(timeout=EVENT_LOG_FLUSH_INTERVAL)
+            except queue.Empty:
+                if self._file is not None:
+                    self._file.flush()
+                continue
+            try:
+                if record is None:
+                    if self._file is not None:
+                        self._file.close()
+                        self._file = None
+                    return
+                self._write(json.dumps(record, default=str) + "\n")
+                # Flush once the queue is drained or every EVENT_LOG_FLUSH_INTERVAL
+                if self._queue.empty() or time.monotonic() - last_flush > EVENT_LOG_FLUSH_INTERVAL:
+                    self._file.flush()
+                    last_flush = time.monotonic()
+            except Exception as e:
+                # Logging must never break a session
+                print(f"Could not write to the event log {self.path}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _write(self, line):
+        data = line.encode("utf-8")
+        if self._file is None:
+            os.makedirs(self.log_dir, exist_ok=True)
+            self._file = open(self.path, "ab")
+        elif self._file.tell() and self._file.tell() + len(data) > self.max_bytes:
+            self._rotate()
+        self._file.write(data)
+
+    def _rotate(self):
+        self._file.close()
+        self.rotations += 1
+        rotated = os.path.join(self.log_dir, f"{self.session}.{self.rotations}.jsonl")
+        os.replace(self.path, rotated)
+        if self.compress:
+            with open(rotated, "rb") as source, gzip.open(f"{rotated}.gz", "wb") as target:
+                shutil.copyfileobj(source, target)
+            os.remove(rotated)
+        self._file = open(self.path, "ab")
+
+
+_event_log = None
+_event_log_lock = threading.Lock()
+
+
+def get_event_log():
+    """ Returns the event log of this process, starting it on first use. """
+    global _event_log
+    with _event_log_lock:
+        if _event_log is None:
+            _event_log = EventLog()
+            atexit.register(_event_log.close)
+        return _event_log
+
+
+def log_event(event, **fields):
+    """ Queues an event in the event log of this process. """
+    get_event_log().log(event, **fields)
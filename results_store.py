@@ -0,0 +1,136 @@
+import csv
+import os
+import sqlite3
+import time
+from urllib.parse import quote
+
+
+# SQLite store of simulation results. tau_factor appends every completed simulation as it arrives,
+# one row per image and direction, with the same columns as data_0.csv plus where the row came from.
+# Re-simulating an image adds new rows, the store keeps the history of all the runs; readers see the
+# latest result of each image and direction unless they ask for the history.
+RESULTS_DB = os.getenv("MICROGPT_RESULTS_DB", "results.sqlite")
+
+# Column names of the simulation result tables (same layout as data_0.csv)
+RESULT_COLUMNS = ["Microstructure", "Effective Diffusivity", "Tortuosity", "Surface Area",
+                  "Volume Fraction Phase 1", "Volume Fraction Phase 2"]
+# Additional columns of the store
+STORE_COLUMNS = ["Image Path", "Direction", "Mode", "Created"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    "Microstructure" TEXT, "Effective Diffusivity" REAL, "Tortuosity" REAL, "Surface Area" REAL,
+    "Volume Fraction Phase 1" REAL, "Volume Fraction Phase 2" REAL,
+    "Image Path" TEXT, "Direction" TEXT, "Mode" TEXT, "Created" REAL
+);
+CREATE INDEX IF NOT EXISTS results_by_image ON results ("Image Path", "Direction");
+"""
+
+
+def quote_identifier(name):
+    """ Quotes a column or table name for use in an SQL statement. """
+    return '"' + name.replace('"', '""') + '"'
+
+
+def connect(db_path=RESULTS_DB):
+    """
+    Opens the results store for appending, creating it if needed.
+
+    :param db_path: Path to the SQLite file.
+    :return: sqlite3 connection.
+    """
+    # Batch workers append from several processes: wait for the lock instead of failing
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def connect_readonly(db_path=RESULTS_DB):
+    """
+    Opens an existing results store for reading, without creating or modifying anything.
+
+    :param db_path: Path to the SQLite file.
+    :return: sqlite3 connection.
+    :raises ValueError: If the database has no results table.
+    """
+    conn = sqlite3.connect(f"file:{quote(os.path.abspath(db_path))}?mode=ro", uri=True, timeout=30)
+    try:
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'results'").fetchone():
+            raise ValueError(f"{db_path} is not a results store (it has no results table)")
+    except Exception:
+        conn.close()
+        raise
+    return conn
+
+
+def select_query(columns=None, history=False):
+    """
+    SQL query of the results store.
+
+    :param columns: Optional list of columns. Default is all columns.
+    :param history: Whether to select the rows of all the runs instead of the latest row of each image and direction.
+    :return: SELECT statement.
+    """
+    selected = ", ".join(quote_identifier(column) for column in columns) if columns else "*"
+    query = f"SELECT {selected} FROM results"
+    if not history:
+        query += ' WHERE rowid IN (SELECT MAX(rowid) FROM results GROUP BY "Image Path", "Direction")'
+    return query
+
+
+def append(image_path, rows, mode=None, db_path=RESULTS_DB):
+    """
+    Appends the results of one simulated image. Earlier results of the same image and direction
+    are kept as history.
+
+    :param image_path: Path to the simulated image.
+    :param rows: Iterable of (direction, row) pairs, where row maps RESULT_COLUMNS to values.
+    :param mode: Mode of the simulation ('full' or 'fast'), or a dictionary of modes by direction.
+    :param db_path: Path to the SQLite file.
+    """
+    columns = RESULT_COLUMNS + STORE_COLUMNS
+    query = (f"INSERT INTO results ({', '.join(quote_identifier(column) for column in columns)}) "
+             f"VALUES ({', '.join('?' * len(columns))})")
+    image_path = os.path.abspath(image_path)
+    created = time.time()
+    conn = connect(db_path)
+    try:
+        with conn:
+            conn.executemany(query, (
+                [row.get(column) for column in RESULT_COLUMNS]
+                + [image_path, direction, mode.get(direction) if isinstance(mode, dict) else mode, created]
+                for direction, row in rows))
+    finally:
+        conn.close()
+
+
+def read_results(db_path=RESULTS_DB, columns=None, history=False):
+    """
+    Reads the results store as a table.
+
+    :param db_path: Path to the SQLite file.
+    :param columns: Optional list of columns. Default is the data_0.csv columns followed by the store columns.
+    :param history: Whether to return the rows of all the runs instead of the latest one of each image and direction.
+    :return: List of lists, the header first, then one row per image and direction (and run, with history).
+    """
+    columns = list(columns or RESULT_COLUMNS + STORE_COLUMNS)
+    conn = connect_readonly(db_path)
+    try:
+        rows = conn.execute(select_query(columns, history)
+                            + ' ORDER BY "Microstructure", "Direction", "Created"').fetchall()
+    finally:
+        conn.close()
+    return [columns] + [list(row) for row in rows]
+
+
+def export_csv(csv_path, db_path=RESULTS_DB, columns=None):
+    """
+    Writes the results store to a CSV file (by default with the data_0.csv columns).
+
+    :return: Number of written rows.
+    """
+    table = read_results(db_path, columns or RESULT_COLUMNS)
+    with open(csv_path, 'w', newline='', encoding='utf-8') as csvfile:
+        csv.writer(csvfile).writerows(table)
+    return len(table) - 1
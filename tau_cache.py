@@ -0,0 +1,244 @@
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+
+# Persistent cache for tau_factor results.
+# entries/<key>.json holds the results of one simulation, keyed by a hash of the voxel data and
+# the solver parameters. fields/<key>.npy holds the solved concentration field of a volume along one
+# direction, keyed by the voxel data and the direction, to warm-start solves with other solver options.
+# stat/<path key>.json maps an image path (plus its mtime and size) to the entry key, so an
+# unchanged file can be answered without reading the image at all.
+CACHE_DIR = os.getenv("MICROGPT_CACHE_DIR", ".tau_cache")
+CACHE_MAX_ENTRIES = int(os.getenv("MICROGPT_CACHE_MAX_ENTRIES", "5000"))
+CACHE_MAX_BYTES = int(os.getenv("MICROGPT_CACHE_MAX_BYTES", str(100 * 1024 * 1024)))
+CACHE_MAX_AGE_DAYS = float(os.getenv("MICROGPT_CACHE_MAX_AGE_DAYS", "30"))
+# Solved fields are large (about 17 MB for a 160^3 volume) and have their own size budget, so
+# storing them never pushes the small result entries out of the cache
+FIELD_CACHE_MAX_BYTES = int(os.getenv("MICROGPT_FIELD_CACHE_MAX_BYTES", str(500 * 1024 * 1024)))
+
+
+def _params_json(params):
+    return json.dumps(params or {}, sort_keys=True)
+
+
+def _write_json_atomic(path, data):
+    # Write to a temporary file first so concurrent workers never read half-written files
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as file:
+        json.dump(data, file)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    try:
+        with open(path, 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def _entry_path(key, cache_dir):
+    return os.path.join(cache_dir, 'entries', f"{key}.json")
+
+
+def _field_path(key, cache_dir):
+    return os.path.join(cache_dir, 'fields', f"{key}.npy")
+
+
+def _stat_path(image_path, params, cache_dir):
+    path_key = hashlib.sha1((os.path.abspath(image_path) + _params_json(params)).encode()).hexdigest()
+    return os.path.join(cache_dir, 'stat', f"{path_key}.json")
+
+
+def _is_expired(path, max_age_days):
+    return max_age_days and time.time() - os.path.getmtime(path) > max_age_days * 86400
+
+
+def data_key(img, params=None):
+    """
+    Computes the content hash of a volume and the solver parameters used to simulate it.
+
+    :param img: The voxel image as a numpy array.
+    :param params: Dictionary of solver parameters that influence the results.
+    :return: Hex digest identifying the simulation.
+    """
+    digest = hashlib.sha256()
+    digest.update(str(img.shape).encode())
+    digest.update(str(img.dtype).encode())
+    digest.update(np.ascontiguousarray(img).data)
+    digest.update(_params_json(params).encode())
+    return digest.hexdigest()
+
+
+def lookup_entry(key, cache_dir=CACHE_DIR, max_age_days=CACHE_MAX_AGE_DAYS):
+    """
+    Returns the cached results for a data key, or None if the entry is missing or expired.
+    """
+    entry_path = _entry_path(key, cache_dir)
+    if not os.path.isfile(entry_path) or _is_expired(entry_path, max_age_days):
+        return None
+    entry = _read_json(entry_path)
+    if entry is None:
+        return None
+    # Refresh the entry so that age eviction is based on the last use
+    try:
+        os.utime(entry_path)
+    except OSError:
+        pass
+    return entry["results"]
+
+
+def key_by_stat(image_path, params=None, cache_dir=CACHE_DIR):
+    """
+    Returns the data key of an unchanged, previously simulated image file using only os.stat, or None.
+    """
+    index = _read_json(_stat_path(image_path, params, cache_dir))
+    if index is None:
+        return None
+    try:
+        stat = os.stat(image_path)
+    except OSError:
+        return None
+    if index["mtime_ns"] != stat.st_mtime_ns or index["size"] != stat.st_size:
+        return None
+    return index["key"]
+
+
+def lookup_by_stat(image_path, params=None, cache_dir=CACHE_DIR, max_age_days=CACHE_MAX_AGE_DAYS):
+    """
+    Looks up the cached results of an image file using only os.stat, without reading the image.
+
+    :param image_path: Path to the image file.
+    :param params: Dictionary of solver parameters.
+    :return: The cached results, or None if the file changed or was never simulated.
+    """
+    key = key_by_stat(image_path, params, cache_dir)
+    if key is None:
+        return None
+    return lookup_entry(key, cache_dir, max_age_days)
+
+
+def store_field(key, field, cache_dir=CACHE_DIR):
+    """
+    Stores the solved concentration field of a simulation, used to warm-start later solves of the same volume.
+    """
+    path = _field_path(key, cache_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp.npy"
+    np.save(tmp_path, field)
+    os.replace(tmp_path, path)
+
+
+def load_field(key, cache_dir=CACHE_DIR):
+    """
+    Returns the stored concentration field of a simulation, or None.
+    """
+    path = _field_path(key, cache_dir)
+    if not os.path.isfile(path):
+        return None
+    try:
+        field = np.load(path)
+    except (OSError, ValueError):
+        return None
+    os.utime(path)
+    return field
+
+
+def record_stat(image_path, key, params=None, cache_dir=CACHE_DIR):
+    """
+    Remembers which data key an image file (at its current mtime and size) corresponds to.
+    """
+    stat = os.stat(image_path)
+    _write_json_atomic(_stat_path(image_path, params, cache_dir),
+                       {"path": os.path.abspath(image_path), "mtime_ns": stat.st_mtime_ns,
+                        "size": stat.st_size, "key": key})
+
+
+def store(image_path, key, results, params=None, cache_dir=CACHE_DIR):
+    """
+    Stores the results of a simulation and indexes the image file it came from.
+
+    :param image_path: Path to the simulated image file.
+    :param key: Data key returned by data_key.
+    :param results: Dictionary of results (D_eff, tau, volume fraction, surface area).
+    :param params: Dictionary of solver parameters.
+    """
+    _write_json_atomic(_entry_path(key, cache_dir),
+                       {"params": params or {}, "created": time.time(), "results": results})
+    record_stat(image_path, key, params, cache_dir)
+    evict_cache(cache_dir=cache_dir)
+
+
+def _list_cache_files(folder, extension):
+    files = []
+    if not os.path.isdir(folder):
+        return files
+    for name in os.listdir(folder):
+        if not name.endswith(extension) or '.tmp' in name:
+            continue
+        path = os.path.join(folder, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, path))
+    return files
+
+
+def _select_evicted(files, max_entries, max_bytes, max_age_days):
+    """ Returns the expired files, then the least recently used ones until the rest fits the limits. """
+    now = time.time()
+    keep = []
+    to_remove = []
+    for mtime, size, path in files:
+        if max_age_days and now - mtime > max_age_days * 86400:
+            to_remove.append(path)
+        else:
+            keep.append((mtime, size, path))
+
+    # Oldest first, so the least recently used files are dropped first
+    keep.sort()
+    total_bytes = sum(size for _, size, _ in keep)
+    while keep and ((max_entries is not None and len(keep) > max_entries) or total_bytes > max_bytes):
+        _, size, path = keep.pop(0)
+        total_bytes -= size
+        to_remove.append(path)
+    return to_remove
+
+
+def evict_cache(max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES,
+                max_age_days=CACHE_MAX_AGE_DAYS, cache_dir=CACHE_DIR, max_field_bytes=FIELD_CACHE_MAX_BYTES):
+    """
+    Removes expired entries, then the least recently used entries until the result entries fit
+    within max_entries and max_bytes, and the solved fields within max_field_bytes.
+
+    :return: Number of removed files.
+    """
+    to_remove = _select_evicted(_list_cache_files(os.path.join(cache_dir, 'entries'), '.json'),
+                                max_entries, max_bytes, max_age_days)
+    to_remove += _select_evicted(_list_cache_files(os.path.join(cache_dir, 'fields'), '.npy'),
+                                 None, max_field_bytes, max_age_days)
+
+    for path in to_remove:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    # Drop the stat index files that point to removed entries
+    stat_dir = os.path.join(cache_dir, 'stat')
+    if to_remove and os.path.isdir(stat_dir):
+        for name in os.listdir(stat_dir):
+            path = os.path.join(stat_dir, name)
+            index = _read_json(path)
+            if index is None or not os.path.isfile(_entry_path(index["key"], cache_dir)):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+    return len(to_remove)
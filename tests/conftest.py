@@ -0,0 +1,82 @@
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+# The modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# The OpenAI clients are created at import time, no request is sent with this key
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+from tool_registry import TOOLS, register_tool  # noqa: E402
+
+
+class LocalServer:
+    """
+    A local HTTP server standing in for a remote API. Routes map a path (without the query), or a
+    (method, path) pair, to a function taking the request handler and returning (status, headers, body).
+    Requests that match no route go to the fallback function, if set.
+    """
+
+    def __init__(self):
+        self.routes = {}
+        self.fallback = None
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _handle(self, method):
+                length = int(self.headers.get('Content-Length') or 0)
+                self.body = self.rfile.read(length) if length else b''
+                path = self.path.split('?')[0]
+                server.requests.append((method, self.path, dict(self.headers)))
+                route = server.routes.get((method, path)) or server.routes.get(path) or server.fallback
+                status, headers, body = route(self) if route else (404, {}, b'not found')
+                if isinstance(body, str):
+                    body = body.encode()
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self._handle('GET')
+
+            def do_POST(self):
+                self._handle('POST')
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def requests_to(self, path):
+        return [request for request in self.requests if request[1].split('?')[0] == path]
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@pytest.fixture
+def local_server():
+    server = LocalServer()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def stub_tools(monkeypatch):
+    """ Registers tools for one test: stub_tools(func, **register_tool options). They are removed afterwards. """
+    def register(func, **options):
+        register_tool(**options)(func)
+        monkeypatch.setitem(TOOLS, func.__name__, TOOLS.pop(func.__name__))
+        return func
+    return register
@@ -0,0 +1,25 @@
+import zipfile
+
+import archive_index
+
+ITEMS = [("1", {"material": "cast_iron", "porosity": "50%"}),
+         ("2", {"material": "castXiron", "porosity": "500"}),
+         ("3", {"material": "steel", "porosity": "5"})]
+
+
+def indexed_archive(tmp_path):
+    archive_path = tmp_path / "dataset.zip"
+    with zipfile.ZipFile(archive_path, 'w') as zip_ref:
+        zip_ref.writestr("metadata.json", "{}")
+    archive_index.store_metadata(str(archive_path), "metadata.json", ITEMS)
+    return str(archive_path)
+
+
+def test_keywords_match_wildcards_literally(tmp_path):
+    archive_path = indexed_archive(tmp_path)
+    fields = ["material", "porosity"]
+
+    assert list(archive_index.query_metadata(archive_path, fields, ["cast_iron"])) == ["1"]
+    assert list(archive_index.query_metadata(archive_path, fields, ["50%"])) == ["1"]
+    assert list(archive_index.query_metadata(archive_path, fields, ["5"])) == ["1", "2", "3"]
+    assert archive_index.query_metadata(archive_path, fields, ["%"]) == {"1": dict(ITEMS[0][1])}
@@ -0,0 +1,193 @@
+import asyncio
+import itertools
+import json
+import re
+import time
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+import async_assistant
+import event_log
+
+
+def stub_echo(text):
+    time.sleep(0.05)
+    return text.upper()
+
+
+def stub_hang():
+    time.sleep(1)
+
+
+class AssistantsStub:
+    """
+    Minimal stand-in for the Assistants API: each run asks for the function calls of `tool_calls`
+    on its second poll, and once their outputs are submitted answers with a message citing two
+    CSV files, both named result.csv.
+    """
+
+    def __init__(self, tool_calls):
+        self.tool_calls = tool_calls
+        self.ids = itertools.count()
+        self.threads = {}
+        self.runs = {}
+        self.submitted = []
+        self.log = []
+
+    def _id(self, prefix):
+        return f"{prefix}_{next(self.ids)}"
+
+    def _run(self, run):
+        data = {"id": run["id"], "object": "thread.run", "created_at": 0, "thread_id": run["thread_id"],
+                "assistant_id": run["assistant_id"], "status": run["status"], "instructions": "", "model": "stub",
+                "tools": [], "file_ids": [], "metadata": {}, "required_action": None, "last_error": None,
+                "expires_at": None, "started_at": None, "cancelled_at": None, "failed_at": None, "completed_at": None}
+        if run["status"] == "requires_action":
+            data["required_action"] = {"type": "submit_tool_outputs", "submit_tool_outputs": {"tool_calls": [
+                {"id": f"call_{index}", "type": "function", "function": {"name": name, "arguments": json.dumps(arguments)}}
+                for index, (name, arguments) in enumerate(self.tool_calls)]}}
+        return data
+
+    def _message(self, thread_id, role, text, run_id=None, file_ids=()):
+        annotations = [{"type": "file_path", "text": "sandbox:/mnt/data/result.csv", "start_index": 0,
+                        "end_index": 10, "file_path": {"file_id": file_id}} for file_id in file_ids]
+        message = {"id": self._id("msg"), "object": "thread.message", "created_at": 0, "thread_id": thread_id,
+                   "role": role, "run_id": run_id, "assistant_id": "asst_stub", "file_ids": [], "metadata": {},
+                   "content": [{"type": "text", "text": {"value": text, "annotations": annotations}}]}
+        self.threads[thread_id].append(message)
+        return message
+
+    def _start_run(self, thread_id, assistant_id):
+        run = {"id": self._id("run"), "thread_id": thread_id, "assistant_id": assistant_id, "status": "queued",
+               "polls": 0}
+        self.runs[run["id"]] = run
+        return run
+
+    def _complete(self, run):
+        run["status"] = "completed"
+        outputs = [output["output"] for output in run["outputs"]]
+        file_ids = [self._id("file"), self._id("file")]
+        self._message(run["thread_id"], "assistant", f"Answer: {' | '.join(outputs)}", run["id"], file_ids)
+
+    def handle(self, request):
+        parsed = urlparse(request.path)
+        path = parsed.path.replace('/v1', '', 1)
+        body = json.loads(request.body or b'{}')
+        self.log.append((request.command, path))
+        if request.command == 'POST':
+            if path == '/threads/runs':
+                thread_id = self._id("thread")
+                self.threads[thread_id] = []
+                for message in body["thread"]["messages"]:
+                    self._message(thread_id, message["role"], message["content"])
+                return self._json(self._run(self._start_run(thread_id, body["assistant_id"])))
+            if (match := re.fullmatch(r'/threads/(\w+)/messages', path)):
+                return self._json(self._message(match.group(1), body["role"], body["content"]))
+            if (match := re.fullmatch(r'/threads/(\w+)/runs', path)):
+                return self._json(self._run(self._start_run(match.group(1), body["assistant_id"])))
+            if (match := re.fullmatch(r'/threads/(\w+)/runs/(\w+)/submit_tool_outputs', path)):
+                run = self.runs[match.group(2)]
+                run["outputs"] = body["tool_outputs"]
+                run["status"] = "in_progress"
+                self.submitted.append(body["tool_outputs"])
+                return self._json(self._run(run))
+        else:
+            if (match := re.fullmatch(r'/threads/(\w+)/runs/(\w+)', path)):
+                run = self.runs[match.group(2)]
+                run["polls"] += 1
+                if run["status"] == "queued" and run["polls"] >= 2:
+                    run["status"] = "requires_action"
+                elif run["status"] == "in_progress":
+                    self._complete(run)
+                return self._json(self._run(run))
+            if re.fullmatch(r'/threads/(\w+)/runs/(\w+)/steps', path):
+                return self._json({"object": "list", "data": [], "first_id": None, "last_id": None, "has_more": False})
+            if (match := re.fullmatch(r'/threads/(\w+)/messages', path)):
+                query = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+                messages = self.threads[match.group(1)]
+                if query.get("order", "desc") == "desc":
+                    messages = messages[::-1]
+                if "after" in query:
+                    messages = messages[[message["id"] for message in messages].index(query["after"]) + 1:]
+                messages = messages[:int(query.get("limit", 20))]
+                return self._json({"object": "list", "data": messages, "has_more": False,
+                                   "first_id": messages[0]["id"] if messages else None,
+                                   "last_id": messages[-1]["id"] if messages else None})
+            if (match := re.fullmatch(r'/files/(\w+)/content', path)):
+                return 200, {'Content-Type': 'application/octet-stream'}, f"file,id\n1,{match.group(1)}\n"
+            if (match := re.fullmatch(r'/files/(\w+)', path)):
+                return self._json({"id": match.group(1), "object": "file", "bytes": 10, "created_at": 0,
+                                   "filename": "/mnt/data/result.csv", "purpose": "assistants",
+                                   "status": "processed"})
+        return 404, {}, json.dumps({"error": {"message": f"No route for {request.command} {path}"}})
+
+    @staticmethod
+    def _json(data):
+        return 200, {'Content-Type': 'application/json'}, json.dumps(data)
+
+
+@pytest.fixture
+def assistants_api(local_server, tmp_path, monkeypatch, stub_tools):
+    stub_tools(stub_echo, description="Echoes its text after a short delay.",
+               properties={"text": {"type": "string", "description": "Text to echo."}}, parallel=True)
+    stub_tools(stub_hang, description="Never answers in time.", parallel=True, timeout=0.2)
+
+    def serve(tool_calls):
+        stub = AssistantsStub(tool_calls)
+        local_server.fallback = stub.handle
+        return stub
+    monkeypatch.setenv("OPENAI_BASE_URL", f"{local_server.url}/v1")
+    monkeypatch.setattr(async_assistant, "_thread_cursors", {})
+    monkeypatch.setattr(event_log, "_event_log", event_log.EventLog(str(tmp_path / "events")))
+    return serve
+
+
+def test_conversation_calls_tools_and_downloads_new_files(assistants_api, local_server, tmp_path):
+    stub = assistants_api([("stub_echo", {"text": "a"}), ("stub_echo", {"text": "b"})])
+    client = async_assistant.get_async_client()
+
+    responses = asyncio.run(async_assistant.run_conversation(client, "asst_stub", ["first", "second"],
+                                                             str(tmp_path / "out")))
+
+    assert len(responses) == 2
+    assert all('{"Results": "A"} | {"Results": "B"}' in response for response in responses)
+    assert [[output["tool_call_id"] for output in outputs] for outputs in stub.submitted] == [["call_0", "call_1"]] * 2
+    # The first turn creates the thread and the run in one request
+    assert stub.log[0] == ('POST', '/threads/runs')
+    # The second turn only lists the messages after the last one seen
+    message_lists = [path for _, path, _ in local_server.requests if re.search(r'/messages\?', path)]
+    assert 'after=' not in message_lists[0] and 'after=' in message_lists[1]
+    # Each turn only downloads the files of its own answer, all named result.csv but saved side by side
+    file_requests = [path for method, path in stub.log if path.startswith('/files/') and path.endswith('/content')]
+    assert len(file_requests) == 4 and len(set(file_requests)) == 4
+    saved = sorted(path.name for path in (tmp_path / "out").iterdir())
+    assert saved == sorted(path.split('/')[2] + '_result.csv' for path in file_requests)
+    assert all((tmp_path / "out" / name).read_text().endswith(name.split('_result')[0] + '\n') for name in saved)
+
+
+def test_conversations_are_served_concurrently(assistants_api, tmp_path):
+    stub = assistants_api([("stub_echo", {"text": "x"})])
+
+    results = asyncio.run(async_assistant.serve_conversations("asst_stub", [["one"], ["two"], ["three"]],
+                                                              str(tmp_path)))
+
+    assert len(results) == 3 and all(len(responses) == 1 for responses in results)
+    for index in range(3):
+        assert len(list((tmp_path / f"conversation_{index}").iterdir())) == 2
+    # All the conversations start before any of them finishes polling
+    thread_starts = [index for index, (method, path) in enumerate(stub.log) if path == '/threads/runs']
+    first_submit = next(index for index, (method, path) in enumerate(stub.log) if path.endswith('/submit_tool_outputs'))
+    assert len(thread_starts) == 3 and max(thread_starts) < first_submit
+
+
+def test_failing_tool_calls_are_submitted_as_errors(assistants_api, tmp_path):
+    stub = assistants_api([("stub_hang", {}), ("missing_tool", {}), ("stub_echo", {"text": "ok"})])
+    client = async_assistant.get_async_client()
+
+    asyncio.run(async_assistant.run_conversation(client, "asst_stub", ["go"], str(tmp_path)))
+
+    outputs = [json.loads(output["output"]) for output in stub.submitted[0]]
+    assert "timed out" in outputs[0]["Error"]
+    assert "Unknown function" in outputs[1]["Error"]
+    assert outputs[2] == {"Results": "OK"}
@@ -0,0 +1,106 @@
+import hashlib
+import json
+
+import utils
+
+CONTENT = bytes(range(256)) * 4096
+FILE_PATH = '/records/123/files/volume.tif'
+
+
+def serve_record(server, content=CONTENT, checksum=None, ranges=True):
+    """ A Zenodo record page with one download link, its API record and the file (with Range support). """
+    checksum = checksum or 'md5:' + hashlib.md5(content).hexdigest()
+    server.routes['/records/123'] = lambda request: (
+        200, {'Content-Type': 'text/html'}, f'<a href="{FILE_PATH}?download=1">volume.tif</a>')
+    server.routes['/api/records/123'] = lambda request: (
+        200, {'Content-Type': 'application/json'}, json.dumps({'files': [{'key': 'volume.tif', 'checksum': checksum}]}))
+
+    def file_route(request):
+        range_header = request.headers.get('Range')
+        if ranges and range_header:
+            start = int(range_header.split('=')[1].rstrip('-'))
+            if start >= len(content):
+                return 416, {'Content-Range': f'bytes */{len(content)}'}, b''
+            return 206, {'Content-Range': f'bytes {start}-{len(content) - 1}/{len(content)}'}, content[start:]
+        return 200, {}, content
+    server.routes[FILE_PATH] = file_route
+
+
+def download(server, folder):
+    return utils.download_links_and_download_files(f"{server.url}/records/123", download_folder=str(folder))
+
+
+def test_download_verifies_checksum(local_server, tmp_path, monkeypatch):
+    monkeypatch.setattr('builtins.input', lambda prompt: 'yes')
+    serve_record(local_server)
+
+    message = download(local_server, tmp_path)
+
+    assert '(md5 verified)' in message
+    assert (tmp_path / 'volume.tif').read_bytes() == CONTENT
+    assert not (tmp_path / 'volume.tif.part').exists()
+
+
+def test_download_resumes_partial_file(local_server, tmp_path, monkeypatch):
+    monkeypatch.setattr('builtins.input', lambda prompt: 'yes')
+    serve_record(local_server)
+    (tmp_path / 'volume.tif.part').write_bytes(CONTENT[:100000])
+
+    message = download(local_server, tmp_path)
+
+    assert '(md5 verified)' in message
+    assert (tmp_path / 'volume.tif').read_bytes() == CONTENT
+    assert any(headers.get('Range') == 'bytes=100000-' for _, _, headers in local_server.requests_to(FILE_PATH))
+
+
+def test_download_completes_already_downloaded_partial_file(local_server, tmp_path, monkeypatch):
+    monkeypatch.setattr('builtins.input', lambda prompt: 'yes')
+    serve_record(local_server)
+    (tmp_path / 'volume.tif.part').write_bytes(CONTENT)
+
+    message = download(local_server, tmp_path)
+
+    assert '(md5 verified)' in message
+    assert (tmp_path / 'volume.tif').read_bytes() == CONTENT
+    assert not (tmp_path / 'volume.tif.part').exists()
+
+
+def test_download_restarts_when_partial_file_is_too_long(local_server, tmp_path, monkeypatch):
+    monkeypatch.setattr('builtins.input', lambda prompt: 'yes')
+    serve_record(local_server)
+    (tmp_path / 'volume.tif.part').write_bytes(CONTENT + b'extra bytes')
+
+    message = download(local_server, tmp_path)
+
+    assert '(md5 verified)' in message
+    assert (tmp_path / 'volume.tif').read_bytes() == CONTENT
+
+
+def test_download_restarts_when_range_is_ignored(local_server, tmp_path, monkeypatch):
+    monkeypatch.setattr('builtins.input', lambda prompt: 'yes')
+    serve_record(local_server, ranges=False)
+    (tmp_path / 'volume.tif.part').write_bytes(b'stale bytes')
+
+    message = download(local_server, tmp_path)
+
+    assert '(md5 verified)' in message
+    assert (tmp_path / 'volume.tif').read_bytes() == CONTENT
+
+
+def test_download_removes_file_with_checksum_mismatch(local_server, tmp_path, monkeypatch):
+    monkeypatch.setattr('builtins.input', lambda prompt: 'yes')
+    serve_record(local_server, checksum='md5:' + '0' * 32)
+
+    message = download(local_server, tmp_path)
+
+    assert 'checksum mismatch' in message
+    assert not (tmp_path / 'volume.tif').exists()
+    assert not (tmp_path / 'volume.tif.part').exists()
+
+
+def test_download_skips_declined_links(local_server, tmp_path, monkeypatch):
+    monkeypatch.setattr('builtins.input', lambda prompt: 'no')
+    serve_record(local_server)
+
+    assert download(local_server, tmp_path) == "No files downloaded"
+    assert not local_server.requests_to(FILE_PATH)
@@ -0,0 +1,46 @@
+import sqlite3
+
+import pytest
+
+import results_store
+import utils
+
+ROW = {"Microstructure": "a.tif", "Effective Diffusivity": 0.2, "Tortuosity": 2.5, "Surface Area": 0.1,
+       "Volume Fraction Phase 1": 0.4, "Volume Fraction Phase 2": 0.6}
+
+
+def test_store_keeps_history_and_reads_latest_results(tmp_path):
+    db_path = str(tmp_path / "results.sqlite")
+    results_store.append("data/a.tif", [("x", ROW)], "fast", db_path)
+    results_store.append("data/a.tif", [("x", dict(ROW, Tortuosity=2.7))], "full", db_path)
+
+    latest = results_store.read_results(db_path, ["Tortuosity", "Mode"])
+    history = results_store.read_results(db_path, ["Tortuosity", "Mode"], history=True)
+
+    assert latest == [["Tortuosity", "Mode"], [2.7, "full"]]
+    assert history == [["Tortuosity", "Mode"], [2.5, "fast"], [2.7, "full"]]
+    assert utils.read_file(db_path, columns=["Tortuosity"])["Rows"] == [[2.7]]
+
+
+def test_read_file_leaves_other_databases_untouched(tmp_path):
+    db_path = tmp_path / "other.db"
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE samples (name TEXT)")
+    conn.commit()
+    conn.close()
+
+    message = utils.read_file(str(db_path))
+
+    assert "not a results store" in message
+    conn = sqlite3.connect(db_path)
+    tables = [name for name, in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+    journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+    conn.close()
+    assert tables == ["samples"]
+    assert journal_mode == "delete"
+
+
+def test_reading_a_missing_store_does_not_create_it(tmp_path):
+    with pytest.raises(sqlite3.OperationalError):
+        results_store.read_results(str(tmp_path / "missing.sqlite"))
+    assert not (tmp_path / "missing.sqlite").exists()
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+import taufactor as tau
+import torch
+
+import utils
+
+
+def random_volume(shape=(40, 40, 40), fraction=0.6, seed=0):
+    return (np.random.default_rng(seed).random(shape) < fraction).astype(np.uint8)
+
+
+def test_solve_stops_at_the_iteration_limit():
+    solution, _ = utils._solve_volume(random_volume(), verbose=False, max_iterations=50, device='cpu')
+
+    assert solution["Iterations"] == 50
+    assert solution["Converged"] is False
+    assert np.isfinite(solution["Tau"])
+
+
+def test_converged_solve_matches_taufactor():
+    img = random_volume()
+    reference = tau.Solver(img, device=torch.device('cpu'))
+    reference.solve(verbose=False)
+
+    solution, _ = utils._solve_volume(img, verbose=False, device='cpu')
+
+    assert solution["Converged"] is True
+    assert solution["Iterations"] == reference.iter
+    assert solution["Tau"] == pytest.approx(reference.tau.item())
+
+
+def test_float64_precision():
+    solver = utils.BoundedSolver(random_volume((10, 10, 10)), device='cpu', precision='float64')
+
+    assert solver.conc.dtype == torch.float64
+    assert solver.nn.dtype == torch.float64
+
+
+def test_warm_start_from_the_same_volume_converges_faster():
+    img = random_volume()
+    loose, field = utils._solve_volume(img, verbose=False, tolerance=2e-2, device='cpu')
+    cold, _ = utils._solve_volume(img, verbose=False, tolerance=5e-3, device='cpu')
+
+    warm, _ = utils._solve_volume(img, verbose=False, tolerance=5e-3, device='cpu', initial_field=field.numpy())
+
+    assert warm["Iterations"] < cold["Iterations"]
+    assert warm["Tau"] == pytest.approx(cold["Tau"], rel=5e-3)
+
+
+def test_warm_start_field_must_match_the_volume():
+    with pytest.raises(ValueError, match="does not match"):
+        utils.BoundedSolver(random_volume((10, 10, 10)), device='cpu', initial_field=np.zeros((1, 8, 12, 12)))
+
+
+def test_volume_without_percolating_path():
+    img = np.ones((10, 10, 10), dtype=np.uint8)
+    img[5] = 0
+
+    solution, _ = utils._solve_volume(img, verbose=False, device='cpu')
+
+    assert solution["Tau"] is None
+    assert solution["Percolating"] is False
@@ -0,0 +1,94 @@
+import json
+import os
+import time
+
+import numpy as np
+import tifffile
+
+import tau_cache
+import utils
+
+PARAMS = {"solver": "Solver", "tolerance": 0.02}
+
+
+def store_entry(cache_dir, image_path, results, params=PARAMS):
+    # The path stands in for the voxels, so that every image has its own entry
+    key = tau_cache.data_key(np.frombuffer(os.path.abspath(image_path).encode(), dtype=np.uint8), params)
+    tau_cache.store(image_path, key, results, params, cache_dir=cache_dir)
+    return key
+
+
+def test_unchanged_file_is_found_by_stat(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    image_path = tmp_path / "a.tif"
+    image_path.write_bytes(b"voxels")
+    store_entry(cache_dir, str(image_path), {"Tau": 1.5})
+
+    assert tau_cache.lookup_by_stat(str(image_path), PARAMS, cache_dir) == {"Tau": 1.5}
+    # Other solver parameters, or a modified file, are not answered from the stat index
+    assert tau_cache.lookup_by_stat(str(image_path), dict(PARAMS, tolerance=0.01), cache_dir) is None
+    stat = os.stat(image_path)
+    os.utime(image_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert tau_cache.lookup_by_stat(str(image_path), PARAMS, cache_dir) is None
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    paths = []
+    for index in range(3):
+        paths.append(str(tmp_path / f"{index}.tif"))
+        open(paths[-1], 'w').close()
+        key = store_entry(cache_dir, paths[-1], {"Tau": index})
+        entry_path = os.path.join(cache_dir, 'entries', f"{key}.json")
+        os.utime(entry_path, (time.time() - 100 + index, time.time() - 100 + index))
+    # Using the oldest entry makes it the most recently used one
+    assert tau_cache.lookup_by_stat(paths[0], PARAMS, cache_dir) == {"Tau": 0}
+
+    removed = tau_cache.evict_cache(max_entries=2, cache_dir=cache_dir)
+
+    assert removed == 1
+    assert tau_cache.lookup_by_stat(paths[1], PARAMS, cache_dir) is None
+    assert [tau_cache.lookup_by_stat(path, PARAMS, cache_dir) for path in (paths[0], paths[2])] == [{"Tau": 0},
+                                                                                                  {"Tau": 2}]
+    # The stat index of the evicted entry is dropped with it
+    assert len(os.listdir(os.path.join(cache_dir, 'stat'))) == 2
+
+
+def test_expired_entries_and_oversized_fields_are_evicted(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    image_path = str(tmp_path / "a.tif")
+    open(image_path, 'w').close()
+    key = store_entry(cache_dir, image_path, {"Tau": 1.5})
+    old = time.time() - 2 * 86400
+    os.utime(os.path.join(cache_dir, 'entries', f"{key}.json"), (old, old))
+    for index in range(3):
+        tau_cache.store_field(f"field{index}", np.zeros(1000, dtype=np.float32), cache_dir)
+        field_time = time.time() - 100 + index
+        os.utime(os.path.join(cache_dir, 'fields', f"field{index}.npy"), (field_time, field_time))
+
+    # About 4 kB per field
+    tau_cache.evict_cache(max_age_days=1, max_field_bytes=6000, cache_dir=cache_dir)
+
+    assert tau_cache.lookup_entry(key, cache_dir) is None
+    # Fields have their own budget: only the most recent one fits
+    assert os.listdir(os.path.join(cache_dir, 'fields')) == ["field2.npy"]
+
+
+def test_tau_factor_answers_a_copied_volume_from_the_cache(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    img = (np.random.default_rng(0).random((20, 20, 20)) < 0.6).astype(np.uint8)
+    tifffile.imwrite("a.tif", img)
+    tifffile.imwrite("b.tif", img)
+
+    first = json.loads(utils.tau_factor("a.tif", results_db=None))
+    calls = []
+    monkeypatch.setattr(utils, "_solve_volume", lambda *args, **kwargs: calls.append(args))
+    monkeypatch.setattr(utils, "load_volume", lambda path: calls.append(path) or tifffile.imread(path))
+
+    again = json.loads(utils.tau_factor("a.tif", results_db=None))
+    copy = json.loads(utils.tau_factor("b.tif", results_db=None))
+
+    assert again["Tau"] == copy["Tau"] == first["Tau"]
+    assert copy["Microstructure"] == "b.tif"
+    # The unchanged file is answered by the stat index, the copy by the hash of its voxels, neither is solved
+    assert calls == ["b.tif"]
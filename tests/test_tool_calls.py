@@ -0,0 +1,47 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import assistant_client_functions as acf
+from tool_registry import TOOLS
+
+
+def slow(seconds):
+    time.sleep(seconds)
+    return threading.current_thread().name
+
+
+def ask():
+    return threading.current_thread().name
+
+
+def test_timeouts_count_from_submission(stub_tools):
+    stub_tools(slow, description="Sleeps.", properties={"seconds": {"type": "number"}}, parallel=True, timeout=0.3)
+    calls = [(f"call_{index}", "slow", {"seconds": 1}) for index in range(4)]
+
+    start = time.perf_counter()
+    responses = acf._run_tool_calls(calls, max_workers=4)
+
+    assert time.perf_counter() - start < 0.9
+    assert all("timed out" in response["Error"] for response in responses.values())
+    assert TOOLS["slow"].metrics["timeouts"] == 4
+
+
+def test_interactive_and_unknown_calls_run_inline(stub_tools, monkeypatch):
+    stub_tools(ask, description="Prompts the user.")
+    stub_tools(slow, description="Sleeps.", properties={"seconds": {"type": "number"}}, parallel=True)
+    submitted = []
+    monkeypatch.setattr(acf.client.beta.threads.runs, "submit_tool_outputs",
+                        lambda **kwargs: submitted.append(kwargs["tool_outputs"]))
+    monkeypatch.setattr(acf, "log_event", lambda *args, **kwargs: None)
+    tool_calls = [SimpleNamespace(id=f"call_{index}", function=SimpleNamespace(name=name, arguments=arguments))
+                  for index, (name, arguments) in enumerate([("ask", "{}"), ("slow", '{"seconds": 0}'), ("missing", "{}")])]
+    run = SimpleNamespace(id="run_0", required_action=SimpleNamespace(
+        submit_tool_outputs=SimpleNamespace(tool_calls=tool_calls, model_dump=dict)))
+
+    acf.handle_required_actions(SimpleNamespace(id="thread_0"), run)
+
+    outputs = [output["output"] for output in submitted[0]]
+    assert threading.main_thread().name in outputs[0]
+    assert threading.main_thread().name not in outputs[1]
+    assert "Unknown function" in outputs[2]
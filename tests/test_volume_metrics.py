@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+from taufactor.metrics import surface_area, volume_fraction
+
+import utils
+
+
+def random_volume(shape, fraction=0.4, seed=0):
+    return (np.random.default_rng(seed).random(shape) < fraction).astype(np.uint8)
+
+
+@pytest.mark.parametrize("slab_voxels", [1, 7 * 9 * 5, 10 ** 6])
+def test_chunked_metrics_match_taufactor(slab_voxels):
+    img = random_volume((12, 9, 7))
+
+    vf, sa = utils.chunked_volume_metrics(img, phase=1, slab_voxels=slab_voxels)
+
+    assert vf == pytest.approx(volume_fraction(img))
+    assert sa == pytest.approx(surface_area(img, phases=[1]).item())
+
+
+def test_chunked_metrics_of_memory_mapped_volume(tmp_path):
+    img = random_volume((16, 8, 8), seed=1)
+    mapped = np.lib.format.open_memmap(tmp_path / "volume.npy", mode='w+', dtype=np.uint8, shape=img.shape)
+    mapped[:] = img
+
+    vf, sa = utils.chunked_volume_metrics(mapped, phase=1, slab_voxels=64)
+
+    assert vf == pytest.approx(volume_fraction(img))
+    assert sa == pytest.approx(surface_area(img, phases=[1]).item())
+
+
+def test_chunked_metrics_of_single_phase_volume():
+    vf, sa = utils.chunked_volume_metrics(np.ones((4, 4, 4), dtype=np.uint8), phase=1)
+
+    assert vf == 1.0
+    assert sa == 0.0
+
+
+def test_two_phase_uint8_volume_is_kept_as_is(tmp_path):
+    img = random_volume((8, 8, 8))
+    mapped = np.lib.format.open_memmap(tmp_path / "volume.npy", mode='w+', dtype=np.uint8, shape=img.shape)
+    mapped[:] = img
+
+    encoded = utils.encode_two_phase(mapped)
+
+    assert isinstance(encoded, np.memmap)
+    assert np.shares_memory(encoded, mapped)
+    assert utils.encode_two_phase(img.astype(bool)).dtype == np.uint8
+
+
+@pytest.mark.parametrize("labels", [(0, 255), (3, 7), (-1, 2)])
+def test_higher_label_becomes_the_conductive_phase(labels):
+    img = random_volume((6, 5, 4))
+    labelled = np.where(img == 1, labels[1], labels[0]).astype(np.int16)
+
+    encoded = utils.encode_two_phase(labelled)
+
+    assert encoded.dtype == np.uint8
+    np.testing.assert_array_equal(encoded, img)
+
+
+def test_more_than_two_phases_are_rejected():
+    img = np.arange(27, dtype=np.uint8).reshape(3, 3, 3) % 3
+
+    with pytest.raises(ValueError, match="two phases"):
+        utils.encode_two_phase(img)
@@ -0,0 +1,91 @@
+import json
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+import utils
+
+TOTAL_HITS = 45
+
+
+@pytest.fixture
+def zenodo(local_server, monkeypatch):
+    """ A local stand-in for the Zenodo search API, with ETags, and an empty search cache. """
+    monkeypatch.setattr(utils, 'ZENODO_API_URL', f"{local_server.url}/api")
+    monkeypatch.setattr(utils, '_zenodo_cache', utils.OrderedDict())
+
+    def search(request):
+        params = {key: values[0] for key, values in parse_qs(urlparse(request.path).query).items()}
+        if params.get('q') == 'broken':
+            return 500, {}, 'server error'
+        etag = f'"{params["q"]}-{params["page"]}"'
+        if request.headers.get('If-None-Match') == etag:
+            return 304, {'ETag': etag}, b''
+        page, size = int(params['page']), int(params['size'])
+        hits = [{'links': {'self_html': f"https://zenodo.org/records/{index}"}}
+                for index in range((page - 1) * size, min(page * size, TOTAL_HITS))]
+        return 200, {'Content-Type': 'application/json', 'ETag': etag}, json.dumps(
+            {'hits': {'hits': hits, 'total': TOTAL_HITS}})
+    local_server.routes['/api/records/'] = search
+    return local_server
+
+
+def searches(server):
+    return server.requests_to('/api/records/')
+
+
+def test_search_fetches_all_pages(zenodo, monkeypatch):
+    monkeypatch.setattr(utils, 'ZENODO_PAGE_SIZE', 10)
+
+    results = utils.search_zenodo_datasets('porous media', max_results=30)
+
+    assert results == [f"https://zenodo.org/records/{index}" for index in range(30)]
+    pages = sorted(parse_qs(urlparse(path).query)['page'][0] for _, path, _ in searches(zenodo))
+    assert pages == ['1', '2', '3']
+
+
+def test_search_stops_at_the_last_result(zenodo, monkeypatch):
+    monkeypatch.setattr(utils, 'ZENODO_PAGE_SIZE', 20)
+
+    results = utils.search_zenodo_datasets('porous media', max_results=100)
+
+    assert len(results) == TOTAL_HITS
+    assert len(searches(zenodo)) == 3
+
+
+def test_repeated_search_is_answered_from_the_cache(zenodo):
+    first = utils.search_zenodo_datasets('porous  media ', max_results=5)
+    second = utils.search_zenodo_datasets(' porous media', max_results=5)
+
+    assert first == second
+    assert len(searches(zenodo)) == 1
+
+
+def test_expired_search_is_revalidated_with_its_etag(zenodo, monkeypatch):
+    monkeypatch.setattr(utils, 'ZENODO_CACHE_TTL', 0)
+
+    first = utils.search_zenodo_datasets('porous media', max_results=5)
+    second = utils.search_zenodo_datasets('porous media', max_results=5)
+
+    assert first == second
+    requests = searches(zenodo)
+    assert len(requests) == 2
+    assert requests[1][2].get('If-None-Match') == '"porous media-1"'
+
+
+def test_search_cache_is_bounded(zenodo, monkeypatch):
+    monkeypatch.setattr(utils, 'ZENODO_CACHE_SIZE', 2)
+
+    for query in ('first', 'second', 'third'):
+        utils.search_zenodo_datasets(query, max_results=5)
+    utils.search_zenodo_datasets('third', max_results=5)
+
+    assert len(utils._zenodo_cache) == 2
+    assert len(searches(zenodo)) == 3
+    # The least recently used search was dropped and is fetched again
+    utils.search_zenodo_datasets('first', max_results=5)
+    assert len(searches(zenodo)) == 4
+
+
+def test_search_error_is_returned_as_message(zenodo):
+    assert utils.search_zenodo_datasets('broken') == "Error: 500"
@@ -0,0 +1,160 @@
+import hashlib
+import json
+import os
+
+from tool_registry import register_tool
+
+
+# Tool outputs larger than this many bytes (about 4 bytes per token) are compacted before they are
+# sent back to the Assistant. The full output is spilled to an artifact file the Assistant can page
+# through with read_tool_artifact.
+TOOL_OUTPUT_BUDGET = int(os.getenv("MICROGPT_TOOL_OUTPUT_BUDGET", "16000"))
+ARTIFACT_DIR = os.getenv("MICROGPT_ARTIFACT_DIR", ".tool_artifacts")
+
+# Number of list items / dictionary keys and string length kept at each compaction level,
+# from the mildest to the most aggressive
+COMPACTION_LEVELS = [(50, 2000), (20, 1000), (10, 500), (5, 200), (3, 100), (1, 50)]
+
+# Default page size of read_tool_artifact
+ARTIFACT_PAGE_ITEMS = 50
+
+
+def _parse_json_text(value):
+    # Tools often return JSON strings (e.g. tau_factor): compact them structurally
+    if not value.startswith(('{', '[')):
+        return None
+    try:
+        return json.loads(value)
+    except ValueError:
+        return None
+
+
+def _shrink(value, max_items, max_chars):
+    """ Deterministically truncate lists, dictionaries and strings of a JSON structure. """
+    if isinstance(value, dict):
+        keys = list(value)
+        shrunk = {key: _shrink(value[key], max_items, max_chars) for key in keys[:max_items]}
+        if len(keys) > max_items:
+            shrunk["..."] = f"{len(keys) - max_items} more keys"
+        return shrunk
+    if isinstance(value, list):
+        shrunk = [_shrink(item, max_items, max_chars) for item in value[:max_items]]
+        if len(value) > max_items:
+            shrunk.append(f"... {len(value) - max_items} more items")
+        return shrunk
+    if isinstance(value, str):
+        parsed = _parse_json_text(value)
+        if parsed is not None:
+            return _shrink(parsed, max_items, max_chars)
+        if len(value) > max_chars:
+            return value[:max_chars] + f"... ({len(value) - max_chars} more characters)"
+    return value
+
+
+def spill_artifact(func_name, payload, artifact_dir=ARTIFACT_DIR):
+    """
+    Writes the full output of a tool call to an artifact file named after its content.
+
+    :param func_name: Name of the tool.
+    :param payload: JSON text of the output.
+    :return: Path to the artifact file.
+    """
+    name = f"{func_name}-{hashlib.sha1(payload.encode()).hexdigest()[:16]}.json"
+    path = os.path.join(artifact_dir, name)
+    if not os.path.isfile(path):
+        os.makedirs(artifact_dir, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            file.write(payload)
+        os.replace(tmp_path, path)
+    return path
+
+
+def compact_output(func_name, response, budget=TOOL_OUTPUT_BUDGET, spill=True):
+    """
+    Serializes the output of a tool call, compacting it to fit the budget.
+
+    :param func_name: Name of the tool.
+    :param response: The output of the tool (any JSON-serializable value).
+    :param budget: Maximum size of the serialized output in bytes.
+    :param spill: Whether to save the full output to an artifact file when it is compacted.
+    :return: JSON text of the output, or of its compacted version with the path of the artifact.
+    """
+    payload = json.dumps(response)
+    if len(payload.encode()) <= budget:
+        return payload
+
+    compacted = {"Compacted": True, "Original Bytes": len(payload.encode())}
+    if spill:
+        compacted["Artifact"] = spill_artifact(func_name, payload)
+        compacted["Note"] = ("The output was too large and was truncated. Call read_tool_artifact with the "
+                             "artifact path, and optionally a path of keys/indices and an offset, to page through it.")
+    else:
+        compacted["Note"] = "The output was too large and was truncated. Ask for a smaller page."
+
+    for max_items, max_chars in COMPACTION_LEVELS:
+        output = json.dumps(dict(compacted, Output=_shrink(response, max_items, max_chars)))
+        if len(output.encode()) <= budget:
+            return output
+    # Still too large (e.g. very deep structures): cut the text itself
+    head = payload.encode()[:max(0, budget - len(json.dumps(compacted).encode()) - 64)]
+    return json.dumps(dict(compacted, Output=head.decode(errors='ignore')))
+
+
+@register_tool(
+    description="Pages through the full output of a previous function call that was too large and was returned compacted. Use it only when the compacted output is not enough.",
+    properties={
+        "artifact": {"type": "string", "description": "The artifact path given in the compacted output."},
+        "path": {"type": "array", "items": {"type": ["string", "integer"]}, "description": "Optional list of dictionary keys and list indices leading to the part of the output to read, e.g. ['Results', 3]."},
+        "offset": {"type": "number", "description": "Index of the first item (or character, for text) to return. Use the 'Next Offset' of the previous page."},
+        "limit": {"type": "number", "description": "Number of items (or characters, for text) to return."}
+    },
+    parallel=True
+)
+def read_tool_artifact(artifact, path=None, offset=0, limit=None):
+    """
+    Pages through the full output of a tool call that was compacted.
+
+    :param artifact: Path to the artifact file.
+    :param path: Optional list of dictionary keys and list indices leading to the part of the output to read.
+    :param offset: Index of the first list item, dictionary key or character to return.
+    :param limit: Number of list items or dictionary keys (default 50), or characters (default half the budget).
+    :return: Dictionary with the page and the offset of the next page (None at the end), or an error message.
+    """
+    artifact = os.path.abspath(artifact)
+    if os.path.dirname(artifact) != os.path.abspath(ARTIFACT_DIR):
+        return {"Error": f"Not a tool artifact: {artifact}"}
+    try:
+        with open(artifact, 'r', encoding='utf-8') as file:
+            value = json.load(file)
+    except (OSError, ValueError) as e:
+        return {"Error": f"Cannot read the artifact: {e}"}
+
+    for key in path or []:
+        if isinstance(value, str):
+            value = _parse_json_text(value)
+        try:
+            value = value[int(key)] if isinstance(value, list) else value[key]
+        except (KeyError, IndexError, TypeError, ValueError):
+            return {"Error": f"Path {path} not found in the artifact"}
+    if isinstance(value, str) and _parse_json_text(value) is not None:
+        value = _parse_json_text(value)
+
+    offset = max(0, int(offset))
+    page = {"Artifact": artifact, "Path": path or [], "Offset": offset}
+    if isinstance(value, (list, dict)):
+        limit = int(limit) if limit else ARTIFACT_PAGE_ITEMS
+        items = list(value.items()) if isinstance(value, dict) else value
+        selected = items[offset:offset + limit]
+        page["Total"] = len(items)
+        page["Items"] = dict(selected) if isinstance(value, dict) else selected
+    elif isinstance(value, str):
+        limit = int(limit) if limit else TOOL_OUTPUT_BUDGET // 2
+        page["Total"] = len(value)
+        page["Text"] = value[offset:offset + limit]
+    else:
+        page["Total"] = 1
+        page["Value"] = value
+        limit = 1
+    page["Next Offset"] = offset + limit if offset + limit < page["Total"] else None
+    return page
@@ -0,0 +1,149 @@
+import inspect
+import os
+import threading
+import time
+
+from tracing import span
+
+
+# Registry of the functions the Assistants can call. Each tool is registered with a decorator,
+# its OpenAI function schema is built once from the decorator and the function signature, and
+# calls are dispatched by name with per-tool concurrency limits, timeouts and timing metrics.
+
+# Default timeout of a tool call in seconds, when it runs on the tool call pool
+TOOL_TIMEOUT = float(os.getenv("MICROGPT_TOOL_TIMEOUT", "1800"))
+
+TOOLS = {}
+
+
+class Tool:
+    """
+    A registered tool: the function, its schema and its call settings and metrics.
+    """
+
+    def __init__(self, name, func, description, properties, response, parallel, max_concurrency, timeout):
+        self.name = name
+        self.func = func
+        self.description = description
+        self.properties = properties
+        self.response = response
+        self.parallel = parallel
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self._semaphore = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+        self._lock = threading.Lock()
+        self.metrics = {"calls": 0, "errors": 0, "timeouts": 0, "total_time": 0.0, "max_time": 0.0}
+
+        parameters = inspect.signature(func).parameters
+        self._accepts_any = any(parameter.kind == parameter.VAR_KEYWORD for parameter in parameters.values())
+        self._parameters = set(parameters)
+        # Arguments without a default value are required
+        required = [name for name, parameter in parameters.items()
+                    if name in properties and parameter.default is inspect.Parameter.empty
+                    and parameter.kind == parameter.POSITIONAL_OR_KEYWORD]
+        self.schema = {
+            "type": "function",
+            "function": {
+                "name": name,
+                "description": description,
+                "parameters": {"type": "object", "properties": properties, "required": required}
+            }
+        }
+
+    def arguments(self, arguments):
+        """ Keep the arguments of the schema that the function accepts. """
+        return {key: value for key, value in arguments.items()
+                if key in self.properties and (key in self._parameters or self._accepts_any)}
+
+    def record(self, elapsed, error=False):
+        with self._lock:
+            self.metrics["calls"] += 1
+            self.metrics["errors"] += int(error)
+            self.metrics["total_time"] += elapsed
+            self.metrics["max_time"] = max(self.metrics["max_time"], elapsed)
+
+    def record_timeout(self):
+        # The call itself keeps running and is recorded when it finishes
+        with self._lock:
+            self.metrics["timeouts"] += 1
+
+
+def register_tool(description, properties=None, name=None, response="Results", parallel=False,
+                  max_concurrency=None, timeout=TOOL_TIMEOUT):
+    """
+    Decorator registering a function as a tool of the Assistants.
+
+    :param description: Description of the tool for the Assistant.
+    :param properties: JSON schema of the arguments, by argument name. Arguments without a default value are required.
+    :param name: Name of the tool. Default is the function name.
+    :param response: Key the result is returned under, or a function building the response from the result.
+    :param parallel: Whether several calls can run at the same time (no user prompt, no pool or run of its own).
+    :param max_concurrency: Maximum number of simultaneous calls of the tool, or None for no limit.
+    :param timeout: Timeout of a call in seconds when it runs on the tool call pool.
+    :return: The decorator, which returns the function unchanged.
+    """
+    def decorator(func):
+        tool_name = name or func.__name__
+        TOOLS[tool_name] = Tool(tool_name, func, description, properties or {}, response, parallel,
+                                max_concurrency, timeout)
+        return func
+    return decorator
+
+
+def get_tool(name):
+    """ Returns a registered tool, raising ValueError for unknown names. """
+    try:
+        return TOOLS[name]
+    except KeyError:
+        raise ValueError(f"Unknown function: {name}")
+
+
+def tool_schemas(*names):
+    """ Returns the schemas of the given tools, in order, for the tools of an Assistant. """
+    return [get_tool(name).schema for name in names]
+
+
+def call_tool(name, arguments, run=None):
+    """
+    Calls a registered tool with the arguments requested by the Assistant.
+
+    :param name: Name of the tool.
+    :param arguments: Dictionary of arguments.
+    :param run: Optional function calling the tool function as run(func, arguments), e.g. in a worker
+                process. The concurrency limit and the metrics of the tool are applied around it.
+    :return: The response of the tool.
+    """
+    tool = get_tool(name)
+    arguments = tool.arguments(arguments)
+    if tool._semaphore is not None:
+        tool._semaphore.acquire()
+    start = time.perf_counter()
+    try:
+        with span(name, "tool"):
+            result = tool.func(**arguments) if run is None else run(tool.func, arguments)
+    except Exception:
+        tool.record(time.perf_counter() - start, error=True)
+        raise
+    finally:
+        if tool._semaphore is not None:
+            tool._semaphore.release()
+    elapsed = time.perf_counter() - start
+    tool.record(elapsed)
+
+    print(f"Function '{name}' called with arguments: {arguments} ({elapsed:.2f}s)")
+    if callable(tool.response):
+        return tool.response(result)
+    return {tool.response: result}
+
+
+def tool_metrics():
+    """
+    Returns the latency metrics of the tools called in this process.
+
+    :return: Dictionary of tool name: {calls, errors, timeouts, total_time, mean_time, max_time}.
+    """
+    metrics = {}
+    for name, tool in TOOLS.items():
+        if tool.metrics["calls"]:
+            metrics[name] = dict(tool.metrics, mean_time=tool.metrics["total_time"] / tool.metrics["calls"])
+    return metrics
@@ -0,0 +1,165 @@
+import atexit
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Not available on Windows
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+# Lightweight tracing of the assistant pipeline: runs, tool calls and the I/O and solver phases are
+# recorded as spans with their wall time, CPU time, peak RSS and bytes read/written, and exported in
+# the Chrome trace format (open the file in chrome://tracing or https://ui.perfetto.dev).
+# Tracing is off unless MICROGPT_TRACE_FILE is set; the trace is then written when the process exits.
+# RSS and I/O counters are those of the whole process, so overlapping spans share them.
+TRACE_FILE = os.getenv("MICROGPT_TRACE_FILE", "")
+
+_trace_file = TRACE_FILE
+_events = []
+_events_lock = threading.Lock()
+# Named tracks (e.g. one per conversation of the asyncio driver) shown as threads of the trace
+_tracks = {}
+
+
+def enable_tracing(path):
+    """
+    Starts recording spans, exported to a Chrome trace file when the process exits.
+
+    :param path: Path to the trace file, or None to stop recording.
+    """
+    global _trace_file
+    _trace_file = path or ""
+
+
+def tracing_enabled():
+    return bool(_trace_file)
+
+
+def _io_counters():
+    # Linux only: characters read/written (including the page cache) and bytes read/written from storage
+    counters = {}
+    try:
+        with open('/proc/self/io') as file:
+            for line in file:
+                key, value = line.split(':')
+                counters[key] = int(value)
+    except (OSError, ValueError):
+        pass
+    return counters
+
+
+def peak_rss_mb():
+    """ Peak resident memory of the process in MB, since the last reset of the high-water mark where supported. """
+    try:
+        with open('/proc/self/status') as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    if resource is not None:
+        # ru_maxrss is in KB on Linux and in bytes on macOS
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(max_rss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+    return None
+
+
+def _track_id(track):
+    with _events_lock:
+        if track not in _tracks:
+            # Negative IDs can't clash with thread IDs
+            _tracks[track] = -(len(_tracks) + 1)
+        return _tracks[track]
+
+
+@contextmanager
+def span(name, category="app", track=None, **attributes):
+    """
+    Records the block as a span of the trace. Does nothing when tracing is off.
+
+    :param name: Name of the span.
+    :param category: Category of the span, e.g. 'run', 'tool', 'io' or 'solve'.
+    :param track: Optional name of the track the span is shown on. Default is the current thread,
+                  use one track per task for spans of asyncio tasks.
+    :param attributes: JSON-serializable attributes of the span.
+    :return: Dictionary of attributes the block can add to.
+    """
+    if not _trace_file:
+        yield attributes
+        return
+    io_start = _io_counters()
+    cpu_start = time.thread_time()
+    process_cpu_start = time.process_time()
+    start = time.perf_counter()
+    try:
+        yield attributes
+    except BaseException as e:
+        attributes["error"] = repr(e)
+        raise
+    finally:
+        end = time.perf_counter()
+        io_end = _io_counters()
+        args = dict(attributes,
+                    cpu_ms=round((time.thread_time() - cpu_start) * 1000, 3),
+                    process_cpu_ms=round((time.process_time() - process_cpu_start) * 1000, 3),
+                    peak_rss_mb=peak_rss_mb())
+        for key, counter in (("read_bytes", "rchar"), ("written_bytes", "wchar"),
+                             ("storage_read_bytes", "read_bytes"), ("storage_written_bytes", "write_bytes")):
+            if counter in io_start and counter in io_end:
+                args[key] = io_end[counter] - io_start[counter]
+        event = {"name": name, "cat": category, "ph": "X", "ts": start * 1e6, "dur": (end - start) * 1e6,
+                 "pid": os.getpid(), "tid": _track_id(track) if track else threading.get_ident(), "args": args}
+        with _events_lock:
+            _events.append(event)
+
+
+def traced(name=None, category="app"):
+    """ Decorator recording each call of a function as a span. """
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _trace_file:
+                return func(*args, **kwargs)
+            with span(span_name, category):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def export_trace(path=None):
+    """
+    Writes the recorded spans to a Chrome trace (JSON) file.
+
+    :param path: Path to the trace file. Default is the file given to enable_tracing or MICROGPT_TRACE_FILE.
+    :return: Path to the trace file, or None if there is nothing to export.
+    """
+    path = path or _trace_file
+    with _events_lock:
+        events = list(_events)
+        tracks = dict(_tracks)
+    if not path or not events:
+        return None
+    pid = os.getpid()
+    metadata = [{"name": "process_name", "ph": "M", "pid": pid, "args": {"name": os.path.basename(sys.argv[0] or "python")}}]
+    metadata += [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": track}}
+                 for track, tid in tracks.items()]
+    metadata += [{"name": "thread_name", "ph": "M", "pid": pid, "tid": thread.ident, "args": {"name": thread.name}}
+                 for thread in threading.enumerate()]
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.{pid}.tmp"
+    with open(tmp_path, 'w') as file:
+        json.dump({"traceEvents": metadata + events, "displayTimeUnit": "ms"}, file)
+    os.replace(tmp_path, path)
+    return path
+
+
+atexit.register(export_trace)
@@ -4,7 +4,17 @@ from taufactor.metrics import surface_area
 from taufactor.metrics import triple_phase_boundary
 import tifffile
 import torch
+import numpy as np
+import sys
+from timeit import default_timer as timer
 import json
+import tau_cache
+import archive_index
+from archive_index import open_zip_chain
+import results_store
+from results_store import RESULT_COLUMNS, RESULTS_DB
+from tool_registry import register_tool
+from tracing import peak_rss_mb, traced
 import os
 import requests
 from bs4 import BeautifulSoup
@@ -12,44 +22,525 @@ from urllib.parse import urljoin, urlparse, unquote
 from email.parser import HeaderParser
 import zipfile
 import shutil
+import xml.etree.ElementTree as ET
+import csv
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import time
+import threading
+import hashlib
+import re
+from collections import OrderedDict
+from requests.adapters import HTTPAdapter
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaFileUpload
 from google_auth_oauthlib.flow import InstalledAppFlow
 
+# Optional: incremental JSON parsing of large metadata files
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# Errors raised while parsing a metadata file
+METADATA_PARSE_ERRORS = (ValueError, ET.ParseError) + ((ijson.JSONError,) if ijson is not None else ())
+
+
+# Voxels per slab when volume fraction and surface area are computed chunk-wise
+METRICS_SLAB_VOXELS = 32 * 1024 * 1024
+
 
-def tau_factor(query_img):
+@traced(category="io")
+def load_volume(query_img):
+    """
+    Loads a TIFF volume, memory-mapped if the file is uncompressed and contiguous, otherwise in memory.
+
+    :param query_img: Path to the TIFF file.
+    :return: numpy array (np.memmap when memory-mapped).
+    """
     try:
-        print("----------------------------------------")
-        print("Function calling...")
-        print("----------------------------------------")
+        return tifffile.memmap(query_img, mode='r')
+    except ValueError:
+        # Compressed or tiled data can't be mapped
+        return tifffile.imread(query_img)
+
+
+def _iter_slabs(img, slab_voxels=METRICS_SLAB_VOXELS):
+    """ Yield consecutive slabs of a volume along its first axis, as in-memory arrays. """
+    slab = max(1, slab_voxels // max(1, int(np.prod(img.shape[1:]))))
+    for start in range(0, img.shape[0], slab):
+        yield np.asarray(img[start:start + slab])
+
+
+def _label_counts(block):
+    """ Voxel count of every label in a block. """
+    if block.dtype == np.uint8:
+        counts = np.bincount(block.ravel(), minlength=2)
+        return {label: int(counts[label]) for label in np.flatnonzero(counts).tolist()}
+    labels, counts = np.unique(block, return_counts=True)
+    return dict(zip(labels.tolist(), counts.tolist()))
+
+
+@traced(category="solve")
+def encode_two_phase(img):
+    """
+    Validates that a volume has (at most) two phases and returns it as a compact uint8 array of 0s and 1s.
+    A volume already stored as 0/1 uint8 is returned as is, so memory-mapped volumes stay mapped.
+    Other labelings are relabeled: the higher label becomes the conductive phase 1.
+
+    :param img: The voxel image as a numpy array.
+    :return: uint8 array of 0s and 1s.
+    :raises ValueError: If the volume has more than two phases.
+    """
+    labels = set()
+    for block in _iter_slabs(img):
+        labels.update(_label_counts(block))
+        if len(labels) > 2:
+            raise ValueError(f"The image must be segmented into two phases, found labels {sorted(labels)[:10]}")
+
+    if labels <= {0, 1}:
+        if img.dtype in (np.uint8, np.bool_):
+            return img.view(np.uint8)
+        return img.astype(np.uint8)
+
+    conductive_label = max(labels)
+    print(f"Relabeling phases {sorted(labels)} to 0/1, with {conductive_label} as phase 1")
+    return (img == conductive_label).astype(np.uint8)
+
+
+@traced(category="solve")
+def pack_volume(img):
+    """
+    Bit-packs a two-phase 0/1 volume (8 voxels per byte), so the cache keys hash 8 times less data.
+
+    :param img: uint8 array of 0s and 1s.
+    :return: 1D uint8 array of the packed voxels. The shape must be kept separately.
+    """
+    # Reads memory-mapped volumes through the mapping, only the packed output is allocated
+    return np.packbits(np.asarray(img), axis=None)
+
+
+@traced(category="solve")
+def chunked_volume_metrics(img, phase=1, slab_voxels=METRICS_SLAB_VOXELS):
+    """
+    Computes the volume fractions and the surface area of one phase of a 3D volume, reading
+    it slab by slab along the first axis so that only one slab is in memory at a time.
+    The results are the same as taufactor's volume_fraction(img) and surface_area(img, phases=[phase]).
+
+    :param img: 3D volume, typically a np.memmap.
+    :param phase: Label of the phase whose surface area is calculated.
+    :param slab_voxels: Approximate number of voxels per slab.
+    :return: Tuple (volume fractions in label order, surface area in faces per unit volume).
+    """
+    x, y, z = img.shape
+
+    label_counts = {}
+    interface_faces = 0
+    previous_layer = None
+    for block in _iter_slabs(img, slab_voxels):
+        for label, count in _label_counts(block).items():
+            label_counts[label] = label_counts.get(label, 0) + count
+
+        # Faces between a voxel of the phase and a voxel of another phase, inside the volume
+        in_phase = block == phase
+        interface_faces += np.count_nonzero(in_phase[1:] != in_phase[:-1])
+        interface_faces += np.count_nonzero(in_phase[:, 1:] != in_phase[:, :-1])
+        interface_faces += np.count_nonzero(in_phase[:, :, 1:] != in_phase[:, :, :-1])
+        # Faces across the boundary with the previous slab
+        if previous_layer is not None:
+            interface_faces += np.count_nonzero(previous_layer != in_phase[0])
+        previous_layer = in_phase[-1]
+
+    total_voxels = x * y * z
+    vf = [label_counts[label] / total_voxels for label in sorted(label_counts)]
+    if len(vf) == 1:
+        vf = vf[0]
+    total_faces = 3 * total_voxels - (x * y + y * z + z * x)
+    sa = float(interface_faces / total_faces)
+    return vf, sa
+
+
+def _reset_peak_rss():
+    # Linux only: writing 5 to clear_refs resets the peak resident set size (VmHWM) of the process
+    try:
+        with open('/proc/self/clear_refs', 'w') as file:
+            file.write('5')
+    except OSError:
+        pass
+
+
+# Whether tau_factor reports the peak memory of each image (set in batch worker processes)
+_measure_peak_rss = False
+
+
+# Default convergence criterion and iteration limit of the solver (taufactor's defaults)
+SOLVER_TOLERANCE = 2e-2
+SOLVER_MAX_ITERATIONS = 5000
+# Solved concentration fields of volumes up to this size are cached, so that a new solve of the same
+# volume and direction (e.g. at a tighter tolerance or a higher iteration limit) starts from them
+WARM_START_MAX_VOXELS = 160 ** 3
+
+# Fast mode: edge length of the sub-volumes solved instead of the whole volume
+FAST_TILE_SIZE = 64
+# Fast mode: the volume is cut into non-overlapping tiles, at most FAST_MAX_TILES of them are solved.
+# Volumes holding fewer than FAST_MIN_TILES tiles are solved in full, which is faster and exact
+FAST_MIN_TILES = 8
+FAST_MAX_TILES = 9
+# Fast mode: relative half-width of the 95% confidence band above which the full solve is run
+FAST_MAX_RELATIVE_UNCERTAINTY = 0.1
+
+# Axis of the volume for each direction. The solver drives the flux along the first axis
+DIRECTION_AXES = {'x': 0, 'y': 1, 'z': 2}
+
+# Maximum number of tau_factor calls running at the same time, each solver already uses several cores
+SIMULATION_MAX_CONCURRENCY = int(os.getenv("MICROGPT_SIMULATION_CONCURRENCY", "2"))
+
+# Argument schemas of the solver options and direction, shared by the simulation tools
+SOLVER_OPTION_PROPERTIES = {
+    "tolerance": {"type": "number", "description": "Convergence tolerance of the solver. Larger is faster but less accurate. Default is 0.02."},
+    "max_iterations": {"type": "number", "description": "Maximum number of solver iterations. Default is 5000."},
+    "precision": {"type": "string", "enum": ["float32", "float64"], "description": "Floating point precision of the solver. float64 is slower and more accurate. Default is float32."},
+    "device": {"type": "string", "enum": ["cpu", "cuda"], "description": "Device to solve on. Default is cuda when available."}
+}
+DIRECTION_PROPERTY = {
+    "type": "string",
+    "enum": ["x", "y", "z", "all"],
+    "description": "Direction of the flux. 'all' solves along x, y and z in parallel and returns tau and D_eff per axis, e.g. to study anisotropy. Default is 'x'."
+}
+
+
+def _to_value(value):
+    # Extract values from tensors or convert to list if more than one element
+    if isinstance(value, torch.Tensor):
+        return value.item() if value.numel() == 1 else value.tolist()
+    return float(value)
+
+
+class BoundedSolver(tau.Solver):
+    """
+    taufactor's two-phase Solver with a solve that stops at iter_limit, an optional float64
+    precision and an optional initial concentration field (warm start from an earlier solve of the same volume).
+    """
+
+    def __init__(self, img, device=None, precision='float32', initial_field=None):
+        if device is None:
+            device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        super().__init__(img, device=torch.device(device))
+        if precision == 'float64':
+            self.precision = torch.double
+            self.conc = self.conc.double()
+            self.nn = self.nn.double()
+            self.cb = [cb.double() for cb in self.cb]
+        if initial_field is not None:
+            if tuple(initial_field.shape) != tuple(self.conc.shape):
+                raise ValueError(f"Warm start field of shape {tuple(initial_field.shape)} "
+                                 f"does not match the volume {tuple(self.conc.shape)}")
+            # Keep the boundary conditions, start the conductive voxels from the given field
+            conductive = torch.tensor(self.cpu_img, dtype=self.precision, device=self.device)
+            field = torch.tensor(initial_field, dtype=self.precision, device=self.device)
+            self.conc[:, 1:-1, 1:-1, 1:-1] = field[:, 1:-1, 1:-1, 1:-1] * conductive
+
+    def solve(self, iter_limit=5000, verbose=True, conv_crit=2*10**-2):
+        iter_limit = max(1, int(iter_limit))
+        with torch.no_grad():
+            start = timer()
+            while not self.converged and self.iter < iter_limit:
+                # find sum of all nearest neighbours
+                out = self.conc[:, 2:, 1:-1, 1:-1] + \
+                    self.conc[:, :-2, 1:-1, 1:-1] + \
+                    self.conc[:, 1:-1, 2:, 1:-1] + \
+                    self.conc[:, 1:-1, :-2, 1:-1] + \
+                    self.conc[:, 1:-1, 1:-1, 2:] + \
+                    self.conc[:, 1:-1, 1:-1, :-2]
+                # divide by n conductive nearest neighbours to give flux
+                out /= self.nn
+                # check convergence using criteria
+                if self.iter % 100 == 0:
+                    self.converged = self.check_convergence(
+                        verbose, conv_crit, start, iter_limit)
+                # efficient way of adding flux to old conc with overrelaxation
+                out -= self.crop(self.conc, 1)
+                out *= self.cb[self.iter % 2]
+                self.conc[:, 1:-1, 1:-1, 1:-1] += out
+                self.iter += 1
+            if not self.converged:
+                # Stopped by the iteration limit: report the values of the last iteration
+                self.converged = self.check_convergence(verbose, conv_crit, start, iter_limit)
+            self.D_mean = self.D_0
+            self.D_eff = self.D_mean*self.D_rel
+            self.end_simulation(iter_limit, verbose, start)
+            return self.tau
+
+
+def _solve_volume(img, verbose=True, tolerance=SOLVER_TOLERANCE, max_iterations=SOLVER_MAX_ITERATIONS,
+                  precision='float32', device=None, initial_field=None):
+    """
+    Run the TauFactor solver on a two-phase volume.
+
+    :return: Tuple (dictionary with D_eff, tau, iterations, solve time and convergence, solved concentration field).
+             Tau is None when no path of the conductive phase connects the two faces (Percolating is False).
+    """
+    # Create a solver object with the loaded image
+    s = BoundedSolver(img, device=device, precision=precision, initial_field=initial_field)
+
+    # Solve for D_eff and tau
+    start = time.perf_counter()
+    s.solve(iter_limit=max_iterations, verbose=verbose, conv_crit=tolerance)
+    # The solver reports an infinite tau without flux, which is not valid JSON
+    tau_value = _to_value(s.tau)
+    percolating = bool(np.isfinite(tau_value))
+    solution = {
+        "Effective Diffusivity": _to_value(s.D_eff),
+        "Tau": tau_value if percolating else None,
+        "Percolating": percolating,
+        "Iterations": s.iter,
+        "Solve Time (s)": round(time.perf_counter() - start, 3),
+        "Converged": bool(s.converged)
+    }
+    return solution, s.conc
 
-        # Read the image file
-        img = tifffile.imread(query_img)
 
-        # Create a solver object with the loaded image
-        s = tau.Solver(img)
+def _tile_grid(shape, tile_size=FAST_TILE_SIZE):
+    """ Number of non-overlapping tiles along each axis of a volume. """
+    return [dim // tile_size for dim in shape]
 
-        # Calculate volume fraction and surface area
-        vf = volume_fraction(img)
-        sa = surface_area(img, phases=[1])
 
-        # Solve for D_eff and tau
-        s.solve()
+def _sub_volumes(img, tile_size=FAST_TILE_SIZE, max_tiles=FAST_MAX_TILES):
+    """
+    Yield representative, non-overlapping sub-volumes of a 3D volume: the corner tiles and the
+    central tile of a grid of tiles centred in the volume.
+    """
+    grid = _tile_grid(img.shape, tile_size)
+    offsets = [(dim - count * tile_size) // 2 for dim, count in zip(img.shape, grid)]
+    if np.prod(grid) <= max_tiles:
+        cells = np.ndindex(*grid)
+    else:
+        cells = {(x, y, z) for x in (0, grid[0] - 1) for y in (0, grid[1] - 1) for z in (0, grid[2] - 1)}
+        cells.add(tuple(count // 2 for count in grid))
+    for cell in sorted(cells):
+        yield np.asarray(img[tuple(slice(offset + index * tile_size, offset + (index + 1) * tile_size)
+                                   for offset, index in zip(offsets, cell))])
+
+
+def estimate_tau_factor(img, tile_size=FAST_TILE_SIZE, **solver_options):
+    """
+    Quickly estimates D_eff and tau of a 3D two-phase volume by solving small, non-overlapping
+    representative sub-volumes instead of the whole volume, and reports a 95% confidence band.
+
+    :param img: uint8 volume of 0s and 1s.
+    :param tile_size: Edge length of the sub-volumes.
+    :param solver_options: tolerance, max_iterations, precision and device, see _solve_volume.
+    :return: Dictionary with the estimates, their confidence bands and whether the estimate is ambiguous.
+    """
+    d_effs, taus = [], []
+    iterations, solve_time, converged = 0, 0.0, True
+    for tile in _sub_volumes(img, tile_size):
+        try:
+            solution, _ = _solve_volume(tile, verbose=False, **solver_options)
+        except ValueError:
+            # Single-phase tile, no meaningful solve
+            continue
+        d_effs.append(solution["Effective Diffusivity"])
+        taus.append(solution["Tau"])
+        iterations += solution["Iterations"]
+        solve_time += solution["Solve Time (s)"]
+        converged = converged and solution["Converged"]
+
+    def band(values):
+        values = np.asarray(values, dtype=float)
+        mean = float(values.mean())
+        half_width = 1.96 * float(values.std(ddof=1)) / np.sqrt(len(values))
+        return mean, [mean - half_width, mean + half_width], half_width / abs(mean) if mean else np.inf
+
+    # A sub-volume without a percolating path says little about the whole volume
+    if len(taus) < 2 or any(tau is None for tau in taus):
+        return {"Ambiguous": True, "Sub-volumes": len(taus)}
+    d_eff_mean, d_eff_band, d_eff_uncertainty = band(d_effs)
+    tau_mean, tau_band, tau_uncertainty = band(taus)
+    return {
+        "Effective Diffusivity": d_eff_mean,
+        "Effective Diffusivity Confidence Band": d_eff_band,
+        "Tau": tau_mean,
+        "Tau Confidence Band": tau_band,
+        "Percolating": True,
+        "Sub-volumes": len(taus),
+        "Iterations": iterations,
+        "Solve Time (s)": round(solve_time, 3),
+        "Converged": converged,
+        "Ambiguous": max(d_eff_uncertainty, tau_uncertainty) > FAST_MAX_RELATIVE_UNCERTAINTY
+    }
 
-        # Extract values from tensors or convert to list if more than one element
-        D_eff_value = s.D_eff.item() if s.D_eff.numel() == 1 else s.D_eff.tolist()
-        tau_value = s.tau.item() if s.tau.numel() == 1 else s.tau.tolist()
-        surface_area_value = sa.item() if sa.numel() == 1 else sa.tolist()
-        volume_fraction_value = vf
+
+@traced(category="solve")
+def _solve_direction(img, direction, mode='full', initial_field=None, **solver_options):
+    """
+    Fast estimate or full solve of D_eff and tau along one direction of a two-phase volume.
+
+    :param initial_field: Solved concentration field of an earlier full solve of the same volume and direction.
+    :return: Tuple (dictionary with the solution and the mode used, solved concentration field or None).
+    """
+    # Move the direction to the first axis, along which the solver drives the flux
+    oriented = np.moveaxis(img, DIRECTION_AXES[direction], 0)
+    if mode == 'fast' and img.ndim == 3:
+        if np.prod(_tile_grid(oriented.shape)) < FAST_MIN_TILES:
+            print(f"The volume is too small for a fast estimate along {direction}, running the full solve...")
+        else:
+            estimate = estimate_tau_factor(oriented, **solver_options)
+            if not estimate.pop("Ambiguous"):
+                return dict(estimate, Mode='fast'), None
+            print(f"The fast estimate along {direction} is ambiguous, running the full solve...")
+    solution, field = _solve_volume(np.ascontiguousarray(oriented), initial_field=initial_field, **solver_options)
+    solution["Mode"] = 'full'
+    solution["Warm Start"] = initial_field is not None
+    return solution, field
+
+
+@register_tool(
+    description="Calculate effective diffusivity, tortuosity factors, volume faction and surface area from tomographic data/3D voxel image. The function is only suitable for two-phase images",
+    properties={
+        "query_img": {"type": "string", "description": "the path of tomographic data/3D voxel image to analyse.                                     it always look like './data/microstructure393.tif', without /mnt"},
+        "D_eff_value": {"type": "number", "description": "the effective diffusivity value"},
+        "tau_value": {"type": "number", "description": "the tortuosity factor value"},
+        "volume_fraction_value": {"type": "number", "description": "the volume fraction value"},
+        "surface_area_value": {"type": "number", "description": "the surface area value"},
+        "mode": {"type": "string", "enum": ["full", "fast"], "description": "'fast' estimates tau and D_eff from sub-volumes and returns a confidence band, for quick comparisons. 'full' solves the whole volume. Default is 'full'."},
+        "direction": DIRECTION_PROPERTY,
+        **SOLVER_OPTION_PROPERTIES
+    },
+    response="These are the JSON-formatted simulation results of the 3D images",
+    parallel=True,
+    max_concurrency=SIMULATION_MAX_CONCURRENCY
+)
+@traced(category="solve")
+def tau_factor(query_img, use_cache=True, mode='full', tolerance=SOLVER_TOLERANCE,
+               max_iterations=SOLVER_MAX_ITERATIONS, precision='float32', device=None, direction='x',
+               results_db=RESULTS_DB):
+    """
+    Calculates effective diffusivity, tortuosity factor, volume fraction and surface area of a two-phase 3D image.
+
+    :param query_img: Path to the TIFF image.
+    :param use_cache: Whether to use the persistent result cache. A full solve of a volume that was solved
+                      before along the same direction with other solver options starts from the cached solution.
+    :param mode: 'full' to solve the whole volume, or 'fast' to estimate tau and D_eff from sub-volumes
+                 with a confidence band. A fast estimate that is ambiguous falls back to the full solve.
+    :param tolerance: Convergence criterion of the solver (relative flux difference between layers).
+    :param max_iterations: Iteration limit of the solver.
+    :param precision: 'float32' or 'float64'.
+    :param device: 'cpu' or 'cuda'. Default is cuda when available.
+    :param direction: 'x', 'y' or 'z' to solve along one axis, or 'all' to solve along the three axes in parallel.
+                      With 'all', D_eff, tau and the solver statistics are dictionaries keyed by axis.
+    :param results_db: SQLite results store the results are appended to (one row per direction), or None.
+    :return: JSON string with the results (including iterations and solve time) or an error message.
+             Tau is null and Percolating false along a direction without a path through the conductive phase.
+    """
+    try:
+        print("----------------------------------------")
+        print("Function calling...")
+        print("----------------------------------------")
+
+        if direction not in DIRECTION_AXES and direction != 'all':
+            raise ValueError(f"Unknown direction {direction!r}, expected 'x', 'y', 'z' or 'all'")
+        directions = list(DIRECTION_AXES) if direction == 'all' else [direction]
+
+        # Parameters that change the results, part of the cache key
+        solver_options = {"tolerance": float(tolerance), "max_iterations": int(max_iterations),
+                          "precision": precision, "device": device}
+        full_params = {"solver": "Solver", "surface_area_phases": [1], "tolerance": float(tolerance),
+                       "max_iterations": int(max_iterations), "precision": precision, "direction": direction}
+        cache_params = {"full": full_params,
+                        "fast": dict(full_params, mode='fast', tile_size=FAST_TILE_SIZE, tiling="grid")}
+        # Full results also answer a fast request
+        lookup_modes = ['full', 'fast'] if mode == 'fast' else ['full']
+
+        # Cheap stat check first: an unchanged file is answered without reading it
+        if use_cache:
+            for lookup_mode in lookup_modes:
+                cached = tau_cache.lookup_by_stat(query_img, cache_params[lookup_mode])
+                if cached is not None:
+                    print(f"Cached results found for {query_img}")
+                    results = _cached_results(cached, query_img)
+                    _record_results(query_img, results, results_db)
+                    return json.dumps(results)
+
+        # Reset the peak memory counter so the reported peak belongs to this image. Only batch workers,
+        # which simulate one image at a time, measure it: concurrent calls share the process counter
+        if _measure_peak_rss:
+            _reset_peak_rss()
+
+        # Read the image file (memory-mapped when possible)
+        img = load_volume(query_img)
+
+        # Check the image is two-phase and keep it as compact 0/1 uint8
+        img = encode_two_phase(img)
+
+        # Same voxels under another path or with a new mtime
+        if use_cache:
+            packed = pack_volume(img)
+            cache_keys = {lookup_mode: tau_cache.data_key(packed, dict(params, shape=list(img.shape)))
+                          for lookup_mode, params in cache_params.items()}
+            # Solved fields depend on the voxels and the direction only, not on the solver options
+            field_keys = {axis: tau_cache.data_key(packed, {"shape": list(img.shape), "direction": axis})
+                          for axis in directions}
+            for lookup_mode in lookup_modes:
+                cached = tau_cache.lookup_entry(cache_keys[lookup_mode])
+                if cached is not None:
+                    print(f"Cached results found for {query_img}")
+                    tau_cache.record_stat(query_img, cache_keys[lookup_mode], cache_params[lookup_mode])
+                    results = _cached_results(cached, query_img)
+                    _record_results(query_img, results, results_db)
+                    return json.dumps(results)
+
+        # Calculate volume fraction and surface area directly on the uint8 volume, slab by slab
+        if img.ndim == 3:
+            vf, sa = chunked_volume_metrics(img, phase=1)
+        else:
+            vf = volume_fraction(img)
+            sa = surface_area(img, phases=[1]).item()
 
         # Construct and return a JSON object containing all results
         results = {
             "Microstructure": query_img.split('/')[-1],
-            "Effective Diffusivity": D_eff_value,
-            "Tau": tau_value,
-            "Volume Fraction": volume_fraction_value,
-            "Surface Area": surface_area_value
+            "Effective Diffusivity": None,
+            "Tau": None,
+            "Volume Fraction": vf,
+            "Surface Area": sa
         }
+
+        # Start from the solution of an earlier solve of the same volume, which converges in fewer iterations
+        store_fields = use_cache and img.ndim == 3 and img.size <= WARM_START_MAX_VOXELS
+        initial_fields = {axis: tau_cache.load_field(field_keys[axis]) if store_fields else None
+                          for axis in directions}
+
+        # The volume is shared by the directional solves, which run in parallel
+        with ThreadPoolExecutor(max_workers=len(directions)) as executor:
+            futures = {axis: executor.submit(_solve_direction, img, axis, mode, initial_fields[axis], **solver_options)
+                       for axis in directions}
+            solutions = {axis: future.result() for axis, future in futures.items()}
+
+        if store_fields:
+            for axis, (_, field) in solutions.items():
+                if field is not None:
+                    tau_cache.store_field(field_keys[axis], field.float().cpu().numpy())
+
+        results_mode = 'fast' if any(solution["Mode"] == 'fast' for solution, _ in solutions.values()) else 'full'
+        if len(directions) == 1:
+            solution, _ = solutions[direction]
+            results.update(solution)
+        else:
+            # One dictionary keyed by axis per result (including the mode used along each axis)
+            names = list(dict.fromkeys(name for solution, _ in solutions.values() for name in solution))
+            for name in names:
+                results[name] = {axis: solution.get(name) for axis, (solution, _) in solutions.items()}
+        results["Direction"] = direction
+
+        if len(directions) == 1:
+            results["Mode"] = results_mode
+        if use_cache:
+            # The peak memory belongs to this run, not to the cached results
+            tau_cache.store(query_img, cache_keys[results_mode], results, cache_params[results_mode])
+        if _measure_peak_rss:
+            results["Peak RSS (MB)"] = peak_rss_mb()
+        _record_results(query_img, results, results_db)
         return json.dumps(results)
 
     except Exception as e:
@@ -59,14 +550,168 @@ def tau_factor(query_img):
         return json.dumps(error)
 
 
+def _cached_results(cached, query_img):
+    # Results cached before the peak memory was left out of the cache still hold the original run's
+    results = {name: value for name, value in cached.items() if name != "Peak RSS (MB)"}
+    results["Microstructure"] = query_img.split('/')[-1]
+    return results
+
+
+def _results_row(results, decimals=4):
+    """ Flatten a tau_factor result dict into a row following RESULT_COLUMNS. """
+    def _round(value):
+        if isinstance(value, dict):
+            # Per-axis results of a multi-direction simulation
+            return {axis: _round(axis_value) for axis, axis_value in value.items()}
+        if isinstance(value, (int, float)) and decimals is not None:
+            return round(value, decimals)
+        return value
+
+    volume_fraction_value = results.get("Volume Fraction")
+    if isinstance(volume_fraction_value, list):
+        # volume_fraction lists the phases in label order, i.e. [phase 0, phase 1]
+        vf_phase_1 = volume_fraction_value[0] if len(volume_fraction_value) > 0 else None
+        vf_phase_2 = volume_fraction_value[1] if len(volume_fraction_value) > 1 else None
+    else:
+        vf_phase_1, vf_phase_2 = volume_fraction_value, None
+
+    return {
+        "Microstructure": results.get("Microstructure"),
+        "Effective Diffusivity": _round(results.get("Effective Diffusivity")),
+        "Tortuosity": _round(results.get("Tau")),
+        "Surface Area": _round(results.get("Surface Area")),
+        "Volume Fraction Phase 1": _round(vf_phase_1),
+        "Volume Fraction Phase 2": _round(vf_phase_2),
+    }
 
-def extract_image_paths(directory):
-    
+
+def _direction_rows(results, decimals=None):
+    """ Yield (direction, row) pairs of a tau_factor result dict, one row per solved direction. """
+    direction = results.get("Direction", "x")
+    if direction != 'all':
+        yield direction, _results_row(results, decimals)
+        return
+    for axis in results["Tau"]:
+        axis_results = {name: value[axis] if isinstance(value, dict) else value for name, value in results.items()}
+        yield axis, _results_row(axis_results, decimals)
+
+
+@traced(category="io")
+def _record_results(query_img, results, results_db):
+    # Append the simulation to the results store; a store that can't be written doesn't fail the simulation
+    if not results_db:
+        return
+    try:
+        results_store.append(query_img, _direction_rows(results), results.get("Mode"), results_db)
+    except Exception as e:
+        print(f"Cannot append the results of {query_img} to {results_db}: {e}")
+
+
+def _init_batch_worker(torch_threads):
+    global _measure_peak_rss
+    # Split the cores between the workers instead of letting every solver use all of them
+    torch.set_num_threads(torch_threads)
+    # A worker simulates one image at a time, so its peak memory belongs to that image
+    _measure_peak_rss = True
+
+
+@register_tool(
+    description="Calculate effective diffusivity, tortuosity factors, volume faction and surface area for ALL the tomographic data/3D voxel images in a directory (or a list of image paths) in one call. The images are simulated in parallel and a compact summary table is returned. Prefer this function over calling tau_factor once per image.",
+    properties={
+        "directory_or_paths": {"type": "string", "description": "The directory of the 3D voxel images to analyse. It always look like './data', without /mnt"},
+        "max_workers": {"type": "number", "description": "Number of parallel worker processes. Default is the number of CPUs."},
+        "output_csv": {"type": "string", "description": "Optional path of a CSV file to store the results in, e.g. './data_0.csv'."},
+        "mode": {"type": "string", "enum": ["full", "fast"], "description": "'fast' estimates tau and D_eff from sub-volumes and returns a confidence band, for quick comparisons. 'full' solves the whole volumes. Default is 'full'."},
+        "direction": DIRECTION_PROPERTY,
+        **SOLVER_OPTION_PROPERTIES
+    },
+    response="These are the JSON-formatted simulation results of the 3D images",
+    max_concurrency=1
+)
+def batch_tau_factor(directory_or_paths, max_workers=None, output_csv=None, mode='full', direction='x',
+                     results_db=RESULTS_DB, **solver_options):
     """
-    Function to extract image paths from a given directory and generate a sentence listing these paths.
+    Runs tau_factor for every volume in a directory (or a list of image paths) on a pool of
+    worker processes. Results are printed as soon as each solve finishes and a single compact
+    summary is returned, so a whole dataset costs one tool call instead of one per image.
+
+    :param directory_or_paths: Directory to search for TIFF images (e.g., './data'), or a list of image paths.
+    :param max_workers: Number of worker processes. Default is the number of CPUs.
+    :param output_csv: Optional path of a CSV file to store the results in (columns of data_0.csv and the direction).
+    :param mode: 'full' or 'fast', see tau_factor.
+    :param direction: 'x', 'y', 'z' or 'all', see tau_factor.
+    :param results_db: SQLite results store every simulation is appended to as soon as it completes, or None.
+    :param solver_options: tolerance, max_iterations, precision and device, see tau_factor.
+    :return: JSON string with the number of processed images, the failures and one compact row per image and direction.
+    """
+    if isinstance(directory_or_paths, str):
+        if os.path.isdir(directory_or_paths):
+            image_paths = list_image_paths(directory_or_paths)
+        else:
+            image_paths = [directory_or_paths]
+    else:
+        image_paths = list(directory_or_paths)
+
+    if not image_paths:
+        return json.dumps({"Images": 0, "Message": f"No TIFF images found in {directory_or_paths}"})
+
+    cpu_count = os.cpu_count() or 1
+    max_workers = int(max_workers) if max_workers else cpu_count
+    max_workers = max(1, min(max_workers, len(image_paths)))
+    torch_threads = max(1, cpu_count // max_workers)
+
+    rows = []
+    failed = []
+    print(f"Running {len(image_paths)} simulations on {max_workers} workers...")
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_batch_worker,
+                             initargs=(torch_threads,)) as executor:
+        futures = {executor.submit(tau_factor, path, True, mode, direction=direction,
+                                   results_db=results_db, **solver_options): path for path in image_paths}
+        for done, future in enumerate(as_completed(futures), start=1):
+            path = futures[future]
+            try:
+                results = json.loads(future.result())
+            except Exception as e:
+                results = {"Microstructure": path.split('/')[-1],
+                           "Error": f"Cannot process image: {e}"}
+
+            if "Error" in results:
+                failed.append(results)
+            else:
+                # One row per solved axis, so the columns stay numeric with direction='all'
+                rows.extend(dict(row, Direction=axis) for axis, row in _direction_rows(results, decimals=4))
+            # Stream the result as soon as it is available
+            print(f"[{done}/{len(image_paths)}] {json.dumps(results)}")
+
+    rows.sort(key=lambda row: (row["Microstructure"], row["Direction"]))
+    columns = RESULT_COLUMNS + ["Direction"]
+
+    if output_csv:
+        with open(output_csv, 'w', newline='', encoding='utf-8') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(rows)
+
+    summary = {
+        "Images": len(image_paths),
+        "Succeeded": len(image_paths) - len(failed),
+        "Failed": failed,
+        "Columns": columns,
+        "Results": [[row[column] for column in columns] for row in rows],
+    }
+    if output_csv:
+        summary["CSV"] = output_csv
+    if results_db:
+        summary["Results Store"] = results_db
+    return json.dumps(summary)
+
+
+def list_image_paths(directory):
+    """
+    Lists the TIFF image paths in a given directory.
 
     :param directory: The local directory to search for image files (e.g., './3DvoxelImage').
-    :return: Tuple containing the path to the output text file with image paths and a sentence listing these paths.
+    :return: List of image paths in './directory_name/filename' format.
     """
     # Define the image extensions to search for (assuming TIFF format)
     image_extensions = {'.tif', '.tiff'}
@@ -78,6 +723,26 @@ def extract_image_paths(directory):
                 # Construct the path with './directory_name/' format
                 image_path = os.path.join(directory, file)
                 image_paths.append(image_path)
+    return image_paths
+
+
+@register_tool(
+    description="This function extracts the filenames of image files within that directory, particularly those in TIFF format, and compiles these filenames into a list. The function then writes this list to a text file and also creates a descriptive sentence that includes all the extracted image paths. ",
+    properties={
+        "directory": {"type": "string", "description": "The local directory to search for image files (e.g., './3DvoxelImage')."}
+    },
+    response=lambda result: {"Image_path": result[1]},
+    parallel=True
+)
+def extract_image_paths(directory):
+    
+    """
+    Function to extract image paths from a given directory and generate a sentence listing these paths.
+
+    :param directory: The local directory to search for image files (e.g., './3DvoxelImage').
+    :return: Tuple containing the path to the output text file with image paths and a sentence listing these paths.
+    """
+    image_paths = list_image_paths(directory)
 
     # Write the image paths to a text file
     output_file_path = os.path.join('.', 'image_paths.txt')
@@ -90,28 +755,111 @@ def extract_image_paths(directory):
 
     return output_file_path, image_path
 
-def search_zenodo_datasets(query, access_token='Ge', max_results=10):
-    # API search URL
-    url = f"https://zenodo.org/api/records/?q={query}&type=dataset"
+# Base URL of the Zenodo API, can be pointed to a local mock server
+ZENODO_API_URL = os.getenv("ZENODO_API_URL", "https://zenodo.org/api")
+# Results per page requested from the Zenodo search API
+ZENODO_PAGE_SIZE = 25
+# Seconds a cached search page is used before it is revalidated with its ETag
+ZENODO_CACHE_TTL = float(os.getenv("MICROGPT_ZENODO_CACHE_TTL", "300"))
+# Number of cached search pages; the least recently used pages are dropped beyond it
+ZENODO_CACHE_SIZE = int(os.getenv("MICROGPT_ZENODO_CACHE_SIZE", "256"))
+# Maximum number of searches running at the same time, to stay within the API rate limits
+ZENODO_MAX_CONCURRENCY = 4
+
+# Cached search pages: normalized request parameters -> (fetch time, ETag, JSON data), in LRU order.
+# Expired pages are kept (up to the size limit) to revalidate them with their ETag
+_zenodo_cache = OrderedDict()
+_zenodo_cache_lock = threading.Lock()
+
+
+def _fetch_zenodo_page(params, headers):
+    """ Fetch one page of Zenodo search results, through the TTL/ETag response cache. """
+    cache_key = json.dumps([sorted(params.items()), 'Authorization' in headers])
+    with _zenodo_cache_lock:
+        cached = _zenodo_cache.get(cache_key)
+        if cached:
+            _zenodo_cache.move_to_end(cache_key)
+    if cached and time.time() - cached[0] < ZENODO_CACHE_TTL:
+        return cached[2]
+
+    request_headers = dict(headers)
+    if cached and cached[1]:
+        request_headers['If-None-Match'] = cached[1]
+    response = get_http_session().get(f"{ZENODO_API_URL}/records/", params=params,
+                                      headers=request_headers, timeout=HTTP_TIMEOUT)
+    if response.status_code == 304 and cached:
+        # Unchanged on the server, keep using the cached page
+        data = cached[2]
+    elif response.status_code == 200:
+        data = response.json()
+    else:
+        raise requests.HTTPError(f"Error: {response.status_code}", response=response)
+
+    with _zenodo_cache_lock:
+        _zenodo_cache[cache_key] = (time.time(), response.headers.get('ETag', cached[1] if cached else None), data)
+        _zenodo_cache.move_to_end(cache_key)
+        while len(_zenodo_cache) > ZENODO_CACHE_SIZE:
+            _zenodo_cache.popitem(last=False)
+    return data
+
+
+@register_tool(
+    description="Searches Zenodo for datasets based on a given query and returns the most relevant results.",
+    properties={
+        "query": {"type": "string", "description": "The search query string to find relevant datasets on Zenodo."},
+        "access_token": {"type": "string", "description": "Access token for authenticating with the Zenodo API."},
+        "max_results": {"type": "number", "description": "Maximum number of search results to return. Default is 10."}
+    },
+    parallel=True,
+    max_concurrency=ZENODO_MAX_CONCURRENCY
+)
+def search_zenodo_datasets(query, access_token=None, max_results=10):
+    """
+    Searches Zenodo for datasets and returns the links of the most relevant records.
+    Responses are cached per normalized query, so repeated searches within a conversation
+    don't hit the API again, and results beyond one page are fetched page by page.
+
+    :param query: The search query string.
+    :param access_token: Zenodo access token. Default is the ZENODO_API_KEY environment variable.
+    :param max_results: Maximum number of results to return.
+    :return: List of record URLs, or an error message.
+    """
+    access_token = access_token or os.getenv("ZENODO_API_KEY")
+    max_results = max(1, int(max_results))
 
     # Set request headers, including the authentication token
-    headers = {
-        'Authorization': f'Bearer {access_token}'
-    }
+    headers = {}
+    if access_token:
+        headers['Authorization'] = f'Bearer {access_token}'
 
-    # Send GET request
-    response = requests.get(url, headers=headers)
+    # Normalize the query so near-identical searches share the cache
+    query = " ".join(str(query).split())
+    page_size = min(max_results, ZENODO_PAGE_SIZE)
 
-    # Check response status
-    if response.status_code == 200:
-        # Parse response data
-        data = response.json()
+    def page_params(page):
+        return {'q': query, 'type': 'dataset', 'size': page_size, 'page': page}
 
-        # Extract and return the most relevant results
-        return [item['links']['self_html'] for item in data['hits']['hits'][:max_results]]
-    else:
+    try:
+        data = _fetch_zenodo_page(page_params(1), headers)
+        hits = list(data['hits']['hits'])
+        total = data['hits'].get('total', len(hits))
+        if isinstance(total, dict):
+            total = total.get('value', len(hits))
+        last_page = (min(max_results, total) + page_size - 1) // page_size
+
+        # Fetch the remaining pages concurrently
+        if last_page > 1:
+            with ThreadPoolExecutor(max_workers=min(4, last_page - 1)) as executor:
+                pages = executor.map(lambda page: _fetch_zenodo_page(page_params(page), headers),
+                                     range(2, last_page + 1))
+                for page_data in pages:
+                    hits.extend(page_data['hits']['hits'])
+    except requests.HTTPError as e:
         # Return error message in case of an error
-        return f"Error: {response.status_code}"
+        return str(e)
+
+    # Extract and return the most relevant results
+    return [item['links']['self_html'] for item in hits[:max_results]]
 
 import json
 from google_auth_oauthlib.flow import InstalledAppFlow
@@ -119,6 +867,14 @@ from googleapiclient.discovery import build
 from googleapiclient.http import MediaFileUpload
 import nbformat as nbf
 
+@register_tool(
+    description="Creates a Python script file with the provided code and executes it upon the user's consent. The script is saved with a specified filename, and the user is prompted to allow its execution.",
+    properties={
+        "code": {"type": "string", "description": "String containing the code to be included in the script."},
+        "output_filename": {"type": "string", "default": "created_script.py", "description": "Filename for the created Python script. Default is 'created_script.py'."}
+    },
+    response="Message"
+)
 def create_and_execute_python_file(code, output_filename='created_script.py'):
     """
     Create a Python script file with the provided code and execute it upon user's consent.
@@ -147,27 +903,86 @@ def create_and_execute_python_file(code, output_filename='created_script.py'):
 
 
 
-def download_links_and_download_files(page_url):
+# Chunk sizes (bytes) of the downloads, adapted to the throughput of the link
+MIN_DOWNLOAD_CHUNK = 64 * 1024
+MAX_DOWNLOAD_CHUNK = 8 * 1024 * 1024
+
+# Timeout (seconds) of the HTTP requests made by the tool functions
+HTTP_TIMEOUT = float(os.getenv("MICROGPT_HTTP_TIMEOUT", "30"))
+
+# Shared HTTP session, so connections are reused between requests
+_http_session = None
+_http_session_lock = threading.Lock()
+
+
+def get_http_session(pool_size=16):
+    """
+    Returns the shared requests session, with a connection pool large enough for concurrent downloads.
+    """
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=3)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _http_session = session
+    return _http_session
+
+
+def _zenodo_checksums(page_url):
+    """ Map the file names of a Zenodo record page to their checksums (e.g. 'md5:...'), if available. """
+    match = re.search(r'/records?/(\d+)', urlparse(page_url).path)
+    if not match:
+        return {}
+    parsed = urlparse(page_url)
+    api_url = f"{parsed.scheme}://{parsed.netloc}/api/records/{match.group(1)}"
+    try:
+        response = get_http_session().get(api_url, timeout=HTTP_TIMEOUT)
+        if response.status_code != 200:
+            return {}
+        files = response.json().get('files', [])
+        return {file['key']: file['checksum'] for file in files if file.get('key') and file.get('checksum')}
+    except (requests.RequestException, ValueError, AttributeError, TypeError):
+        return {}
+
+
+@register_tool(
+    description="Accesses a specified webpage, finds all links containing the word 'download', and offers to download each file. If confirmed, the function downloads the file, saves it locally, and uploads it to Google Drive.",
+    properties={
+        "page_url": {"type": "string", "description": "URL of the web page to search for download links."},
+        "folder_id": {"type": "string", "description": "ID of the Google Drive folder where the file will be uploaded. Default is a predefined folder ID."},
+        "credentials_file": {"type": "string", "description": "Path to the credentials JSON file for Google Drive API. Default is 'credentials.json'."}
+    },
+    response="Message"
+)
+def download_links_and_download_files(page_url, max_workers=4, download_folder='.'):
     """
     Accesses a specified webpage, searches for all links that contain the word 'download',
-    and prompts the user whether to download each found file. If the user agrees, the function
-    downloads the file and saves it locally.
+    and prompts the user whether to download each found file. The accepted files are then
+    downloaded concurrently over a shared connection pool. Interrupted downloads are resumed
+    from their '.part' file with HTTP Range requests, and files are verified against the
+    checksums of the Zenodo record when available.
 
     :param page_url: URL of the web page to search for download links.
+    :param max_workers: Number of files downloaded at the same time.
+    :param download_folder: Folder where the files are saved.
     
     """
-    
+    session = get_http_session()
+    checksums = _zenodo_checksums(page_url)
+
     def find_download_links(url):
-        response = requests.get(url)
+        response = session.get(url, timeout=HTTP_TIMEOUT)
         if response.status_code != 200:
             return f"Unable to access the page. Status code: {response.status_code}"
         soup = BeautifulSoup(response.content, 'html.parser')
         links = soup.find_all('a', href=True)
         return set(urljoin(url, link['href']) for link in links if 'download' in link['href'])
 
-    def download_file(url, default_filename):
-        response = requests.get(url, stream=True)
+    def get_filename(response, url, default_filename):
         # try to get filename from Content-Disposition header
+        filename = None
         content_disp = response.headers.get('content-disposition')
         if content_disp:
             header_parser = HeaderParser()
@@ -182,64 +997,329 @@ def download_links_and_download_files(page_url):
         if not filename:
             # if filename is not present in URL, use default filename
             filename = 'downloaded_file'
+        return os.path.basename(filename)
 
-        # download file
-        with open(filename, 'wb') as file:
-            for chunk in response.iter_content(chunk_size=8192):
+    @traced(category="io")
+    def download_file(url, default_filename):
+        response = session.get(url, stream=True, timeout=HTTP_TIMEOUT)
+        response.raise_for_status()
+        filename = get_filename(response, url, default_filename)
+        file_path = os.path.join(download_folder, filename)
+        part_path = file_path + '.part'
+
+        checksum = checksums.get(filename)
+        hasher = None
+        if checksum and ':' in checksum:
+            algorithm, expected = checksum.split(':', 1)
+            try:
+                hasher = hashlib.new(algorithm)
+            except ValueError:
+                hasher = None
+
+        # Resume a partial download
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        complete = False
+        if offset:
+            file_size = response.headers.get('Content-Length')
+            response.close()
+            response = session.get(url, stream=True, timeout=HTTP_TIMEOUT, headers={'Range': f'bytes={offset}-'})
+            if response.status_code == 416:
+                # Nothing left after the offset: the partial file is complete if it has the size of the
+                # file. Without the size, the checksum verification below decides
+                response.close()
+                complete = offset == int(file_size) if file_size else hasher is not None
+                if not complete:
+                    print(f"The partial download of {filename} doesn't match the file, starting again")
+                    offset = 0
+                    response = session.get(url, stream=True, timeout=HTTP_TIMEOUT)
+                    response.raise_for_status()
+            else:
+                response.raise_for_status()
+                if response.status_code != 206:
+                    # The server ignored the Range header, start again
+                    offset = 0
+            if offset:
+                print(f"{filename} is already downloaded" if complete else f"Resuming {filename} from {offset} bytes")
+                if hasher:
+                    with open(part_path, 'rb') as file:
+                        for block in iter(lambda: file.read(1024 * 1024), b''):
+                            hasher.update(block)
+
+        # download file, adapting the chunk size to the throughput of the link
+        chunk_size = MIN_DOWNLOAD_CHUNK
+        with open(part_path, 'ab' if offset else 'wb') as file:
+            while not complete:
+                chunk_start = time.perf_counter()
+                chunk = response.raw.read(chunk_size, decode_content=True)
+                if not chunk:
+                    break
                 file.write(chunk)
-        print(f"File downloaded: {filename}")
-        return filename
+                if hasher:
+                    hasher.update(chunk)
+                chunk_time = time.perf_counter() - chunk_start
+                if chunk_time < 0.05:
+                    chunk_size = min(chunk_size * 2, MAX_DOWNLOAD_CHUNK)
+                elif chunk_time > 0.5:
+                    chunk_size = max(chunk_size // 2, MIN_DOWNLOAD_CHUNK)
+
+        if hasher and hasher.hexdigest() != expected:
+            os.remove(part_path)
+            print(f"Checksum mismatch: {filename}")
+            return f"{filename} (checksum mismatch, removed)"
+
+        os.replace(part_path, file_path)
+        print(f"File downloaded: {file_path}")
+        return f"{file_path} ({algorithm} verified)" if hasher else file_path
 
     download_links = find_download_links(page_url)
 
+    if isinstance(download_links, str):
+        return download_links
     if not download_links:
         return "No download links found"
-    
-    downloaded_files = []
+
+    selected_links = []
     for link in download_links:
         answer = input(f"Do you want to download the file from {link}? (yes/no): ")
         if answer.lower() == 'yes':
-            filename = link.split('/')[-1]
-            down_load_filename = download_file(link, filename)
-            # upload_google_drive(down_load_filename)
-            downloaded_files.append(down_load_filename)
+            selected_links.append(link)
 
-    if downloaded_files:
-        return f"Downloaded files: {', '.join(downloaded_files)}"
-    else:
+    if not selected_links:
         return "No files downloaded"
+
+    os.makedirs(download_folder, exist_ok=True)
+    downloaded_files = []
+    with ThreadPoolExecutor(max_workers=max(1, min(int(max_workers), len(selected_links)))) as executor:
+        futures = {executor.submit(download_file, link, unquote(urlparse(link).path.split('/')[-1])): link
+                   for link in selected_links}
+        for future in as_completed(futures):
+            try:
+                downloaded_files.append(future.result())
+                # upload_google_drive(down_load_filename)
+            except (requests.RequestException, OSError) as e:
+                downloaded_files.append(f"{futures[future]} (failed: {e}, run again to resume)")
+
+    return f"Downloaded files: {', '.join(downloaded_files)}"
     
 
-def extract_and_organize_files(zip_file_path, output_folder, file_extension):
+@register_tool(
+    description="Extracts files from a specified ZIP archive and organizes files with a certain extension into a designated output folder. IMPORTNANT: Don't use the function when user ask for data filter!!!",
+    properties={
+        "zip_file_path": {"type": "string", "description": "Path to the ZIP file to be extracted.it always look like './Microsturcture.zip',  without ./mnt/data"},
+        "output_folder": {"type": "string", "description": "Path to the folder where files with the specified extension will be organized."},
+        "file_extension": {"type": "string", "description": "The file extension of the files to be organized (e.g., 'txt', 'jpg')."}
+    },
+    response="Message"
+)
+def extract_and_organize_files(zip_file_path, output_folder, file_extension, max_workers=4):
+    """
+    Extracts the files with a given extension from a ZIP archive straight into an output folder.
+    Only the matching members are read, several of them are decompressed at the same time.
+
+    :param zip_file_path: Path to the ZIP file.
+    :param output_folder: Folder where the files with the specified extension are written.
+    :param file_extension: The file extension of the files to extract (e.g., 'tif').
+    :param max_workers: Number of members decompressed concurrently.
+    :return: Message with the number of extracted files, throughput and skipped members.
+    """
     # Check if the file is a ZIP format
     if not zip_file_path.endswith('.zip'):
         print("The file is not a ZIP archive.")
-        return
-
-    # Unzip the ZIP file
-    with zipfile.ZipFile(zip_file_path, 'r') as zip_ref:
-        zip_ref.extractall("extracted")
+        return "The file is not a ZIP archive."
 
     # Create a new folder to store files of the specified format
     os.makedirs(output_folder, exist_ok=True)
 
-    # Search for all files of the specified format in the extracted folder
-    for root, dirs, files in os.walk("extracted"):
-        for file in files:
-            if file.lower().endswith('.' + file_extension):
-                source_file = os.path.join(root, file)
-                shutil.copy(source_file, output_folder)
-
-    print(f"All {file_extension.upper()} files have been copied to {output_folder}")
+    # Select the members of the specified format from the name list, without reading them
+    suffix = '.' + file_extension.lower().lstrip('.')
+    with zipfile.ZipFile(zip_file_path, 'r') as zip_ref:
+        members = [info for info in zip_ref.infolist() if not info.is_dir()]
+    # Files are written without their folders, so the last member with a given name wins
+    matching = {}
+    for info in members:
+        if info.filename.lower().endswith(suffix):
+            matching[os.path.basename(info.filename)] = info
+    matching = list(matching.values())
+    skipped = len(members) - len(matching)
+
+    @traced(category="io")
+    def extract_members(infos):
+        # Every worker reads through its own handle on the archive
+        written = 0
+        with zipfile.ZipFile(zip_file_path, 'r') as zip_ref:
+            for info in infos:
+                destination_file_path = os.path.join(output_folder, os.path.basename(info.filename))
+                with zip_ref.open(info) as source, open(destination_file_path, 'wb') as target:
+                    shutil.copyfileobj(source, target, 1024 * 1024)
+                written += info.file_size
+        return written
+
+    start = time.perf_counter()
+    # Largest members first, spread over the workers
+    matching.sort(key=lambda info: info.file_size, reverse=True)
+    workers = max(1, min(int(max_workers), len(matching)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        bytes_written = sum(executor.map(extract_members, [matching[i::workers] for i in range(workers)]))
+    elapsed = time.perf_counter() - start
+
+    rate = bytes_written / elapsed / 1e6 if elapsed > 0 else 0.0
+    message = (f"Extracted {len(matching)} {file_extension.upper()} files ({bytes_written / 1e6:.1f} MB) "
+               f"to {output_folder} in {elapsed:.2f}s ({rate:.1f} MB/s), skipped {skipped} other members.")
+    print(message)
+    return message
 
 import csv
-def read_file(file_path):
+# read_file: number of rows returned at most, and number of rows read at a time from big tables
+READ_FILE_MAX_ROWS = int(os.getenv("MICROGPT_READ_FILE_MAX_ROWS", "200"))
+READ_FILE_CHUNK_ROWS = int(os.getenv("MICROGPT_READ_FILE_CHUNK_ROWS", "100000"))
+# Summaries are combined chunk by chunk. Quartiles are computed on a uniform sample of this many
+# matching rows, and the most frequent value of a column is tracked up to this many distinct values
+READ_FILE_SUMMARY_SAMPLE_ROWS = int(os.getenv("MICROGPT_READ_FILE_SUMMARY_SAMPLE_ROWS", "100000"))
+READ_FILE_SUMMARY_MAX_DISTINCT = 10000
+
+# Row filters of read_file: {"column": ..., "op": ..., "value": ...}
+FILTER_OPERATORS = {
+    '==': lambda column, value: column == value,
+    '!=': lambda column, value: column != value,
+    '<': lambda column, value: column < value,
+    '<=': lambda column, value: column <= value,
+    '>': lambda column, value: column > value,
+    '>=': lambda column, value: column >= value,
+    'in': lambda column, value: column.isin(value if isinstance(value, list) else [value]),
+    'contains': lambda column, value: column.astype(str).str.contains(str(value), case=False, regex=False),
+}
+
+
+def _filter_mask(df, filters):
+    """ Boolean mask of the rows of a DataFrame matching all the filters. """
+    mask = pd.Series(True, index=df.index)
+    for condition in filters or []:
+        op = condition.get("op", "==")
+        if op not in FILTER_OPERATORS:
+            raise ValueError(f"Unknown filter operator {op!r}, expected one of {list(FILTER_OPERATORS)}")
+        if condition["column"] not in df.columns:
+            raise ValueError(f"Unknown column {condition['column']!r}, the columns are {list(df.columns)}")
+        mask &= FILTER_OPERATORS[op](df[condition["column"]], condition.get("value"))
+    return mask
+
+
+def _read_table_chunks(file_path, file_extension, columns=None, chunk_rows=READ_FILE_CHUNK_ROWS):
+    """ Yield the rows of a CSV, Parquet or results store file as DataFrames, reading only the given columns. """
+    if file_extension == '.csv':
+        yield from pd.read_csv(file_path, usecols=columns, chunksize=chunk_rows)
+    elif file_extension == '.parquet':
+        # Columnar: only the selected columns are read from disk
+        yield pd.read_parquet(file_path, columns=columns)
+    else:
+        # Read-only: other SQLite files are neither given a results table nor switched to WAL
+        conn = results_store.connect_readonly(file_path)
+        try:
+            yield from pd.read_sql_query(results_store.select_query(columns), conn, chunksize=chunk_rows)
+        finally:
+            conn.close()
+
+
+_SAMPLE_KEY = "__sample_key__"
+
+
+def _sample_rows(reservoir, chunk, size, rng):
+    """
+    Keeps the size rows with the smallest random keys among the reservoir and a new chunk, so the
+    reservoir is a uniform sample of all the rows seen so far.
+    """
+    chunk = chunk.assign(**{_SAMPLE_KEY: rng.random(len(chunk))})
+    merged = chunk if reservoir is None else pd.concat([reservoir, chunk], ignore_index=True)
+    return merged.nsmallest(size, _SAMPLE_KEY) if len(merged) > size else merged
+
+
+def _update_summary(stats, chunk):
+    """ Adds a chunk of rows to the running count, mean, variance, min, max and value counts of each column. """
+    for column in chunk.columns:
+        values = chunk[column].dropna()
+        entry = stats.setdefault(column, {"count": 0, "numeric": True, "mean": 0.0, "m2": 0.0,
+                                          "min": None, "max": None, "values": {}})
+        numeric = pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values)
+        entry["numeric"] = entry["numeric"] and numeric
+        if entry["values"] is not None:
+            for value, count in values.value_counts().items():
+                entry["values"][value] = entry["values"].get(value, 0) + int(count)
+            if len(entry["values"]) > READ_FILE_SUMMARY_MAX_DISTINCT:
+                entry["values"] = None
+        if values.empty:
+            continue
+        if entry["numeric"]:
+            # Combine the mean and the sum of squared deviations of the chunk with the running ones
+            count, mean = len(values), float(values.mean())
+            m2 = float(((values - mean) ** 2).sum())
+            total = entry["count"] + count
+            delta = mean - entry["mean"]
+            entry["m2"] += m2 + delta ** 2 * entry["count"] * count / total
+            entry["mean"] += delta * count / total
+            entry["min"] = float(values.min()) if entry["min"] is None else min(entry["min"], float(values.min()))
+            entry["max"] = float(values.max()) if entry["max"] is None else max(entry["max"], float(values.max()))
+        entry["count"] += len(values)
+
+
+def _summary_results(stats, sample):
+    """ Summary statistics of each column, like DataFrame.describe, from the running statistics. """
+    summary = {}
+    for column, entry in stats.items():
+        column_summary = {"count": entry["count"]}
+        if entry["numeric"] and entry["count"]:
+            column_summary["mean"] = entry["mean"]
+            if entry["count"] > 1:
+                column_summary["std"] = (entry["m2"] / (entry["count"] - 1)) ** 0.5
+            quartiles = sample[column].dropna().astype(float).quantile([0.25, 0.5, 0.75])
+            column_summary.update({"min": entry["min"], "25%": float(quartiles[0.25]),
+                                   "50%": float(quartiles[0.5]), "75%": float(quartiles[0.75]), "max": entry["max"]})
+        elif not entry["numeric"] and entry["values"]:
+            top, freq = max(entry["values"].items(), key=lambda item: item[1])
+            column_summary.update({"unique": len(entry["values"]), "top": top, "freq": freq})
+        summary[str(column)] = column_summary
+    return json.loads(json.dumps(summary, default=str))
+
+
+@register_tool(
+    description="Reads a file and returns its contents based on the file extension. It supports .py files, returned as a string, and tables: .csv, .parquet and the simulation results store (.sqlite, e.g. './results.sqlite', where every simulation is stored as soon as it completes, read as the latest result of each image and direction). For tables, select only the columns and rows you need with columns and filters, or ask for summary statistics, instead of reading the whole table. Tables are returned as the column names, the number of matching rows and the rows (at most max_rows).",
+    properties={
+        "file_path": {"type": "string", "description": "Path to the file to be read. The path look like './example.csv' or './script.py', without ./mnt/data."},
+        "columns": {"type": "array", "items": {"type": "string"}, "description": "Optional list of the table columns to return, e.g. ['Microstructure', 'Tortuosity']. Default is all columns."},
+        "filters": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "column": {"type": "string"},
+                    "op": {"type": "string", "enum": list(FILTER_OPERATORS)},
+                    "value": {"description": "Value to compare with. A list for 'in', a text for 'contains'."}
+                },
+                "required": ["column", "op", "value"]
+            },
+            "description": "Optional row filters, all of which must match, e.g. [{'column': 'Microstructure', 'op': 'contains', 'value': '393'}]."
+        },
+        "sample": {"type": "number", "description": "Optional number of matching rows to pick at random instead of the first ones."},
+        "summary": {"type": "boolean", "description": "If true, return summary statistics (count, mean, std, min, quartiles, max) of the selected columns over the matching rows instead of the rows."},
+        "max_rows": {"type": "number", "description": "Maximum number of rows to return. Default is 200."}
+    },
+    parallel=True
+)
+def read_file(file_path, columns=None, filters=None, sample=None, summary=False, max_rows=READ_FILE_MAX_ROWS):
     """
-    Reads a file and returns its contents based on the file extension.
+    Reads a file and returns its contents based on the file extension. Tables are read column by
+    column and chunk by chunk, and only the selected slice of the table is returned.
 
     :param file_path: str, the path to the file.
+    :param columns: Optional list of the table columns to return. Default is all columns.
+    :param filters: Optional list of row filters {"column": ..., "op": ..., "value": ...}, all of which must match.
+                    op is one of ==, !=, <, <=, >, >=, in (value is a list) and contains (case-insensitive text).
+    :param sample: Optional number of matching rows to pick at random instead of the first ones.
+    :param summary: If True, return summary statistics (count, mean, std, min, quartiles, max, ...) of the
+                    selected columns over the matching rows instead of the rows. Quartiles are computed on a
+                    uniform sample of the rows on large tables.
+    :param max_rows: Maximum number of rows to return.
     :return: Depending on the file extension:
-             - list of lists for CSV files,
+             - for CSV, Parquet and SQLite results store (.sqlite, .db) files, a dictionary with the
+               columns, the number of matching rows and the rows (or the summary),
              - string for Python files,
              - error message if the file cannot be processed or the type is unsupported.
     """
@@ -248,13 +1328,59 @@ def read_file(file_path):
     file_extension = file_extension.lower()
 
     try:
-        if file_extension == '.csv':
-            content = []
-            with open(file_path, newline='', encoding='utf-8') as csvfile:
-                reader = csv.reader(csvfile)
-                for row in reader:
-                    content.append(row)
-            return content
+        if file_extension in ('.csv', '.parquet', '.sqlite', '.db'):
+            if not os.path.isfile(file_path):
+                raise FileNotFoundError(file_path)
+            max_rows = max(0, int(max_rows))
+            # Read the filtered columns as well, and project after filtering
+            filter_columns = [condition["column"] for condition in filters or []]
+            read_columns = list(dict.fromkeys(list(columns) + filter_columns)) if columns else None
+            # Only a bounded number of rows is kept in memory: the first max_rows matching rows, or a
+            # uniform sample of them (for sampling, and for the quartiles of summaries)
+            if summary:
+                sample_size = READ_FILE_SUMMARY_SAMPLE_ROWS
+            else:
+                sample_size = min(int(sample), max_rows) if sample else 0
+            rng = np.random.default_rng()
+
+            selected = []
+            reservoir = None
+            stats = {}
+            table_columns = list(columns or [])
+            matched_rows = 0
+            for chunk in _read_table_chunks(file_path, file_extension, read_columns):
+                if filters:
+                    chunk = chunk[_filter_mask(chunk, filters)]
+                if columns:
+                    chunk = chunk[list(columns)]
+                table_columns = list(chunk.columns)
+                matched_rows += len(chunk)
+                if summary:
+                    _update_summary(stats, chunk)
+                if sample_size:
+                    reservoir = _sample_rows(reservoir, chunk, sample_size, rng)
+                else:
+                    needed = max_rows - sum(len(part) for part in selected)
+                    if needed > 0:
+                        selected.append(chunk.iloc[:needed])
+
+            if reservoir is not None:
+                table = reservoir.drop(columns=_SAMPLE_KEY)
+            elif selected:
+                table = pd.concat(selected)
+            else:
+                table = pd.DataFrame(columns=table_columns)
+            results = {"Columns": [str(column) for column in table_columns], "Matched Rows": matched_rows}
+            if summary:
+                results["Summary"] = _summary_results(stats, table)
+                if matched_rows > sample_size:
+                    results["Approximate Quartiles"] = True
+                return results
+            table = table.iloc[:max_rows]
+            results["Rows"] = json.loads(table.to_json(orient='values'))
+            if len(table) < matched_rows:
+                results["Truncated"] = True
+            return results
 
         elif file_extension == '.py':
             with open(file_path, 'r', encoding='utf-8') as file:
@@ -265,10 +1391,21 @@ def read_file(file_path):
 
     except FileNotFoundError:
         return f"File not found: {file_path}"
+    except ImportError as e:
+        return f"Missing dependency to read {file_extension} files: {e}"
     except Exception as e:
         return f"An error occurred: {e}"
 
 
+@register_tool(
+    description="Uploads a specified file to a designated folder on Google Drive using Google Drive API. Requires OAuth2 credentials for authentication.",
+    properties={
+        "upload_filename": {"type": "string", "description": "The name of the file to be uploaded."},
+        "folder_id": {"type": "string", "description": "The ID of the Google Drive folder where the file will be uploaded. Default is '18rx0j7qYvW_5Hhyu84alYhcQdWLqRXRa'.", "default": "18rx0j7qYvW_5Hhyu84alYhcQdWLqRXRa"},
+        "credentials_file": {"type": "string", "description": "The path to the JSON file containing OAuth2 credentials for Google Drive API. Default is 'credentials.json'.", "default": "credentials.json"}
+    },
+    response="Message"
+)
 def upload_google_drive(upload_filename, folder_id='18rx0j7qYvW_5Hhyu84alYhcQdWLqRXRa', credentials_file='credentials.json'):
     """
     Uploads a file to a specific Google Drive folder and returns the link to the uploaded file.
@@ -303,60 +1440,186 @@ def upload_google_drive(upload_filename, folder_id='18rx0j7qYvW_5Hhyu84alYhcQdWL
     return f"'{upload_filename}' is uploaded to Google Drive. Its file id is {file_id}. Link to the file: {file_link}"
 
 
-def find_json(file_or_dir_path):
+@register_tool(
+    description="Unzips a zip file or searches a directory to find metadata files in JSON or XML format. Prompts the user for confirmation before extracting the metadata. Returns the contents of the metadata file or a message if no metadata is found.",
+    properties={
+        "file_or_dir_path": {"type": "string", "description": "The path to the zip file or directory where the metadata search is performed, it is always look like ./+filename, without mnt/data/."},
+        "fields": {"type": "string", "description": "Optional comma-separated metadata fields to extract, e.g. 'description, keywords'. Only these fields are read. If not given, the user is asked."}
+    },
+    response="Message"
+)
+def find_json(file_or_dir_path, fields=None):
     """
-    Searches a zip file or a directory for JSON files.
-    Asks the user to confirm if a found JSON file is the metadata file.
+    Searches a zip file or a directory for JSON (or XML) metadata files.
+    Zip archives are not extracted: the members are listed from the central directory and
+    only the metadata candidates are read, straight from the archive.
+    Asks the user to confirm if a found file is the metadata file.
     If confirmed, lists the keys of the JSON structure and asks the user which parts to extract.
-    Returns the contents of the selected parts for all items in the JSON file.
+    The file is then parsed item by item (incrementally when ijson is installed) and only the
+    selected parts are kept.
 
     :param file_or_dir_path: Path to the zip file or directory.
+    :param fields: Optional list (or comma-separated string) of the fields to extract. If not given, the user is asked.
     :return: The contents of the selected parts of the JSON file or a message if not found.
     """
-    def is_non_empty_file(fpath):  
-        return os.path.isfile(fpath) and os.path.getsize(fpath) > 0
+    metadata_extensions = ('.json', '.xml')
 
-    def extract_selected_data(json_content, keys_to_extract):
+    def extract_selected_data(items, keys_to_extract):
         extracted_data = {}
-        for item_id, item_data in json_content.items():
+        for item_id, item_data in items:
             extracted_data[item_id] = {key: item_data[key] for key in keys_to_extract if key in item_data}
         return extracted_data
 
-    def search_metadata(directory):
-        for root, dirs, files in os.walk(directory):
-            for file in files:
-                if file.endswith('.json') and is_non_empty_file(os.path.join(root, file)):
-                    file_path = os.path.join(root, file)
-                    user_confirm = input(f"Found file: {file}. Is this the metadata file? (yes/no): ").lower()
-                    if user_confirm == 'yes':
-                        with open(file_path, 'r') as metadata_file:
-                            try:
-                                json_content = json.load(metadata_file)
-                                first_item = next(iter(json_content.values()))
-                                if isinstance(first_item, dict):
-                                    keys = list(first_item.keys())
-                                    print("JSON file contains items with the following fields:")
-                                    print("\n".join(keys))
-                                    user_keys = input("Enter the fields you want to extract (separated by commas): ")
-                                    selected_keys = [key.strip() for key in user_keys.split(',')]
-                                    return extract_selected_data(json_content, selected_keys)
-                                else:
-                                    return "JSON file does not contain a valid structure."
-                            except json.JSONDecodeError:
-                                return "Invalid JSON format in file."
+    def iter_json_items(open_file):
+        """ Yield the (item_id, item_data) pairs of the top-level JSON object. """
+        with open_file() as metadata_file:
+            if ijson is not None:
+                yield from ijson.kvitems(metadata_file, '', use_float=True)
+            else:
+                yield from json.load(metadata_file).items()
+
+    def iter_xml_items(open_file):
+        """ Yield the children of the XML root element as (item_id, item_data) pairs. """
+        with open_file() as metadata_file:
+            depth = 0
+            index = 0
+            for event, elem in ET.iterparse(metadata_file, events=('start', 'end')):
+                if event == 'start':
+                    depth += 1
+                    continue
+                depth -= 1
+                if depth == 1:
+                    item_data = dict(elem.attrib)
+                    item_data.update({child.tag: child.text for child in elem})
+                    yield elem.get('id') or f"{elem.tag}_{index}", item_data
+                    index += 1
+                    # Free the parsed item, only the selected fields are kept
+                    elem.clear()
+
+    def select_keys(keys):
+        if fields:
+            selected_keys = fields
+        else:
+            print("JSON file contains items with the following fields:")
+            print("\n".join(keys))
+            selected_keys = input("Enter the fields you want to extract (separated by commas): ")
+        if isinstance(selected_keys, str):
+            selected_keys = selected_keys.split(',')
+        return [key.strip() for key in selected_keys]
+
+    def parse_metadata(name, open_file, archive_path=None):
+        iter_items = iter_xml_items if name.lower().endswith('.xml') else iter_json_items
+        try:
+            # Only the first item is needed to list the available fields
+            first_item = next(iter_items(open_file), (None, None))[1]
+            if isinstance(first_item, dict):
+                if archive_path is not None:
+                    # Index all the fields once, later queries on the archive are index lookups
+                    archive_index.store_metadata(archive_path, name, iter_items(open_file))
+                    selected_keys = select_keys(archive_index.metadata_fields(archive_path))
+                    return archive_index.query_metadata(archive_path, selected_keys)
+                selected_keys = select_keys(list(first_item.keys()))
+                return extract_selected_data(iter_items(open_file), selected_keys)
+            else:
+                return "JSON file does not contain a valid structure."
+        except METADATA_PARSE_ERRORS:
+            return "Invalid JSON format in file."
+
+    def search_metadata(candidates, archive_path=None):
+        for name, open_file in candidates:
+            user_confirm = input(f"Found file: {os.path.basename(name)}. Is this the metadata file? (yes/no): ").lower()
+            if user_confirm == 'yes':
+                return parse_metadata(name, open_file, archive_path)
 
         return "No metadata found."
 
+    def zip_candidates(zip_ref):
+        for info in zip_ref.infolist():
+            if not info.is_dir() and info.file_size > 0 and info.filename.lower().endswith(metadata_extensions):
+                yield info.filename, lambda info=info: zip_ref.open(info)
+
+    def directory_candidates(directory):
+        for root, dirs, files in os.walk(directory):
+            for file in files:
+                file_path = os.path.join(root, file)
+                if file.lower().endswith(metadata_extensions) and os.path.getsize(file_path) > 0:
+                    yield file_path, lambda file_path=file_path: open(file_path, 'rb')
+
     if zipfile.is_zipfile(file_or_dir_path):
+        indexed_fields = archive_index.metadata_fields(file_or_dir_path)
+        if indexed_fields:
+            # The metadata of this archive is already indexed
+            print(f"Using the indexed metadata of {file_or_dir_path}")
+            return archive_index.query_metadata(file_or_dir_path, select_keys(indexed_fields))
         with zipfile.ZipFile(file_or_dir_path, 'r') as zip_ref:
-            zip_ref.extractall("temp_unzip_folder")
-        result = search_metadata("temp_unzip_folder")
+            result = search_metadata(zip_candidates(zip_ref), file_or_dir_path)
     else:
-        result = search_metadata(file_or_dir_path)
+        result = search_metadata(directory_candidates(file_or_dir_path))
 
     return result if result else "No metadata found."
 
 
+@register_tool(
+    description="Searches the metadata of a zip dataset, indexed by a previous find_json call, for the items whose fields contain all the given keywords. Much faster than reading the metadata again.",
+    properties={
+        "archive_path": {"type": "string", "description": "The path to the zip file, it is always look like ./+filename.zip, without mnt/data/."},
+        "keywords": {"type": "string", "description": "Comma-separated keywords that must all appear in the item, e.g. 'cast iron'."},
+        "fields": {"type": "string", "description": "Optional comma-separated metadata fields to search and return, e.g. 'description, keywords'. Default is all fields."}
+    },
+    response="Message",
+    parallel=True
+)
+def search_metadata_index(archive_path, keywords, fields=None):
+    """
+    Searches the indexed metadata of a zip archive (indexed by find_json) for items matching keywords.
+
+    :param archive_path: Path to the zip archive (e.g., './microlibDataset.zip').
+    :param keywords: List (or comma-separated string) of keywords that must all appear in the fields, e.g. 'cast iron'.
+    :param fields: Optional list (or comma-separated string) of the fields to search and return. Default is all fields.
+    :return: Dictionary of the matching items and their fields, or a message if the metadata is not indexed.
+    """
+    indexed_fields = archive_index.metadata_fields(archive_path)
+    if not indexed_fields:
+        return "The metadata of this archive is not indexed yet. Call find_json first."
+    if isinstance(keywords, str):
+        keywords = keywords.split(',')
+    if isinstance(fields, str):
+        fields = fields.split(',')
+    keywords = [keyword.strip() for keyword in keywords if keyword.strip()]
+    fields = [field.strip() for field in fields] if fields else indexed_fields
+    return archive_index.query_metadata(archive_path, fields, keywords)
+
+
+# Member index of the zip files searched so far, keyed by (path, mtime, size)
+_zip_member_index = {}
+
+
+@traced(category="io")
+def build_zip_member_index(zip_path):
+    """
+    Lists every file in a zip file, including the files in nested zip files.
+    The index is kept for as long as the zip file is unchanged (in memory and in the archive's
+    sidecar index), so repeated searches don't rescan it.
+
+    :param zip_path: Path to the zip file.
+    :return: List of (chain, member name) tuples, where chain is the tuple of nested zip members containing the file.
+    """
+    stat = os.stat(zip_path)
+    cache_key = (os.path.abspath(zip_path), stat.st_mtime_ns, stat.st_size)
+    if cache_key not in _zip_member_index:
+        _zip_member_index[cache_key] = archive_index.index_members(zip_path)
+    return _zip_member_index[cache_key]
+
+
+@register_tool(
+    description="Extracts files with a specified name from a given folder or zip file, including any nested folders and zip files within. The function searches for files that match the target filename in the source path, which can be either a directory or a zip file. If found, the files are extracted to a specified destination folder.",
+    properties={
+        "source_path": {"type": "string", "description": "Path to the source folder or zip file."},
+        "target_filename": {"type": "string", "description": "Name of the file to search for and extract."},
+        "destination_folder": {"type": "string", "default": "DATA", "description": "Folder where the extracted files will be stored. Default is 'DATA'."}
+    },
+    response=lambda result: {"Message": "Files extracted successfully."}
+)
 def extract_files_from_folder_or_zip(source_path, target_filename, destination_folder='DATA'):
     """
     Extracts files with the specified name from a given folder or zip file,
@@ -372,25 +1635,23 @@ def extract_files_from_folder_or_zip(source_path, target_filename, destination_f
     if not os.path.exists(destination_folder):
         os.makedirs(destination_folder)
 
+    @traced(category="io")
     def search_and_extract_from_zip(zip_path):
         """ Search and extract matching files from the given zip file. """
-        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            for file in zip_ref.namelist():
-                if file.endswith(target_filename):
+        # Group the matching members by the nested archive they are in
+        matches = {}
+        for chain, file in build_zip_member_index(zip_path):
+            # Matching nested archives are extracted as files, not searched
+            if file.endswith(target_filename) and not any(name.endswith(target_filename) for name in chain):
+                matches.setdefault(chain, []).append(file)
+
+        for chain, files in matches.items():
+            with open_zip_chain(zip_path, chain) as zip_ref:
+                for file in files:
                     # Extract file directly to the destination folder without the original folder structure
-                    target_file = zip_ref.open(file)
                     destination_file_path = os.path.join(destination_folder, os.path.basename(file))
-                    with open(destination_file_path, 'wb') as f:
+                    with zip_ref.open(file) as target_file, open(destination_file_path, 'wb') as f:
                         shutil.copyfileobj(target_file, f)
-                elif file.endswith('.zip'):
-                    # Temporarily extract nested zip file to a temp folder
-                    temp_folder = os.path.join(destination_folder, 'temp_zip_extraction')
-                    os.makedirs(temp_folder, exist_ok=True)
-                    zip_ref.extract(file, temp_folder)
-                    nested_zip_path = os.path.join(temp_folder, file)
-                    search_and_extract_from_zip(nested_zip_path)
-                    # Clean up the temp folder
-                    shutil.rmtree(temp_folder)
 
     def search_and_extract_from_folder(folder_path):
         """ Search and extract matching files from the given folder. """